@@ -0,0 +1,130 @@
+"""
+Pool of user accounts used for deliveries.
+USER_SESSIONS in .env lists the session names (default: just 'session').
+Recipients are spread over the accounts with a consistent-hash ring, so
+adding or removing an account only moves about 1/N of them. When an
+account cannot reach a chat (not a member, banned, private...) the next
+account on the ring is used, and that is remembered for a while.
+"""
+import bisect
+import hashlib
+import os
+import time
+
+from telethon import errors
+
+import state_db
+from entity_cache import cache_key
+from user_client import UserClientManager, DEFAULT_SESSION
+
+VIRTUAL_NODES = 160
+
+# How long (hours) an account is skipped for a chat it could not reach
+DEFAULT_UNREACHABLE_TTL_HOURS = 24
+
+# Errors meaning this account cannot post to the chat, while another one might
+MEMBERSHIP_ERRORS = (
+    errors.ChannelPrivateError,
+    errors.ChannelInvalidError,
+    errors.ChatIdInvalidError,
+    errors.PeerIdInvalidError,
+    errors.ChatWriteForbiddenError,
+    errors.UserBannedInChannelError,
+    ValueError,  # get_input_entity(): the account has never seen this chat
+)
+
+
+def get_session_names():
+    names = [name.strip() for name in os.getenv('USER_SESSIONS', '').split(',') if name.strip()]
+    return names or [DEFAULT_SESSION]
+
+
+def _ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=VIRTUAL_NODES):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_ring_hash(f"{node}#{i}"), node)
+            for node in self.nodes for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def preference(self, key):
+        """All nodes, in the order they should be tried for `key`."""
+        if len(self.nodes) <= 1:
+            return list(self.nodes)
+        order = []
+        start = bisect.bisect(self._hashes, _ring_hash(key))
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
+
+
+class AccountPool:
+    def __init__(self, sessions=None, primary=None, path=None):
+        """`primary` is an existing UserClientManager to reuse for its session."""
+        self.managers = {}
+        if primary is not None:
+            self.managers[primary.session] = primary
+        for name in sessions or get_session_names():
+            if name not in self.managers:
+                self.managers[name] = UserClientManager(name)
+        self.ring = HashRing(self.managers)
+        self.ttl = float(os.getenv('UNREACHABLE_TTL', DEFAULT_UNREACHABLE_TTL_HOURS)) * 3600
+        self.conn = state_db.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_unreachable (
+                account TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                failed_at REAL NOT NULL,
+                PRIMARY KEY (account, recipient)
+            )
+        """)
+
+    def __len__(self):
+        return len(self.managers)
+
+    def accounts_for(self, peer, available=None):
+        """
+        Session names to try for `peer`: ring order, with accounts that recently
+        could not reach it moved to the end.
+        """
+        key = cache_key(peer)
+        order = self.ring.preference(key)
+        if available is not None:
+            order = [name for name in order if name in available]
+        unreachable = self._unreachable(key)
+        if not unreachable:
+            return order
+        return [n for n in order if n not in unreachable] + [n for n in order if n in unreachable]
+
+    def _unreachable(self, key):
+        rows = self.conn.execute(
+            "SELECT account FROM account_unreachable WHERE recipient = ? AND failed_at > ?",
+            (key, time.time() - self.ttl)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_unreachable(self, account, peer):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO account_unreachable (account, recipient, failed_at) VALUES (?, ?, ?)",
+            (account, cache_key(peer), time.time())
+        )
+
+    def mark_reachable(self, account, peer):
+        self.conn.execute(
+            "DELETE FROM account_unreachable WHERE account = ? AND recipient = ?",
+            (account, cache_key(peer))
+        )
+
+    async def disconnect(self):
+        for manager in self.managers.values():
+            await manager.disconnect()
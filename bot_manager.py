@@ -1,14 +1,27 @@
 import os
 import asyncio
-import yaml
 import io
 import qrcode
 import re
-from datetime import datetime
-from telethon import TelegramClient, events, Button
+from datetime import timedelta
+from telethon import events, Button
 from telethon.errors import FloodWaitError
+from telethon.tl.types import MessageMediaPhoto
 from dotenv import load_dotenv
 from telegram_sender import TelegramSender
+from scheduler import (
+    Scheduler, WorkerPool, DAYS_OF_WEEK, get_weekly_days, compile_schedule_strict, utc_now,
+    DEFAULT_CONCURRENCY, DEFAULT_JOB_TIMEOUT, DEFAULT_PREWARM_MINUTES
+)
+from ledger import FireLedger, get_grace_window, slot_key
+from outbox import DeliveryOutbox
+import image_pipeline
+from storage import get_storage
+from user_client import UserClientManager
+from account_pool import AccountPool
+from flood_governor import GovernedTelegramClient
+from cleanup import CleanupCheckpoints, delete_messages_by_keywords
+import message_index
 
 # Load environment variables
 load_dotenv()
@@ -25,8 +38,23 @@ if not all([API_ID, API_HASH, BOT_TOKEN, ADMIN_ID]):
     print("Error: Missing required environment variables (API_ID, API_HASH, BOT_TOKEN, ADMIN_ID)")
     exit(1)
 
-# Create the bot client
-bot = TelegramClient('bot_session', int(API_ID), API_HASH)
+# Create the bot client (its requests are paced by the bot account's FloodGovernor)
+bot = GovernedTelegramClient('bot_session', int(API_ID), API_HASH)
+
+# Shared user-account client (connected lazily, reused by all features)
+user_clients = UserClientManager()
+
+# Sending accounts (USER_SESSIONS); the main session above is always one of them
+account_pool = AccountPool(primary=user_clients)
+
+# Per-recipient delivery items; failed ones are retried by outbox_loop()
+outbox = DeliveryOutbox()
+
+# Progress of delete-by-word jobs, so an interrupted or repeated job resumes
+cleanup_checkpoints = CleanupCheckpoints()
+
+# Optional local full-text index of the account's messages (MESSAGE_INDEX)
+messages_index = message_index.MessageIndex() if message_index.is_enabled() else None
 
 # Main menu buttons
 MAIN_MENU = [
@@ -50,8 +78,15 @@ async def start_handler(event):
     await event.respond("Welcome to **Bot Manager**!", buttons=MAIN_MENU)
     raise events.StopPropagation
 
-CONFIG_PATH = 'messages.yaml'
-DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# messages.yaml or messages.db, depending on STORAGE_BACKEND
+config_store = get_storage()
+
+# Heap of upcoming fire times, shared by the scheduler loop and config writers.
+# PREWARM_MINUTES before each fire time recipients are resolved and media uploaded.
+PREWARM_MINUTES = float(os.getenv('PREWARM_MINUTES', DEFAULT_PREWARM_MINUTES))
+scheduler = Scheduler(prewarm_lead=timedelta(minutes=PREWARM_MINUTES))
+SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', DEFAULT_CONCURRENCY))
+SCHEDULER_JOB_TIMEOUT = int(os.getenv('SCHEDULER_JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT))
 
 
 def normalize_time_str(time_str):
@@ -70,20 +105,21 @@ def normalize_time_str(time_str):
     return f"{hour:02d}:{minute:02d}"
 
 
-def get_weekly_days(schedule):
-    """Backward compatible reader for weekly schedule days."""
-    if not schedule or schedule.get('type') != 'weekly':
-        return []
-
-    days = schedule.get('days')
-    if isinstance(days, list):
-        return [d for d in days if d in DAYS_OF_WEEK]
+def parse_cron_input(text):
+    """Parse '<cron expression> [IANA timezone]' into a schedule dict, or None."""
+    tokens = text.split()
+    candidates = [{'type': 'cron', 'cron': ' '.join(tokens)}]
+    if len(tokens) > 1:
+        candidates.append({'type': 'cron', 'cron': ' '.join(tokens[:-1]), 'timezone': tokens[-1]})
 
-    day = schedule.get('day')
-    if isinstance(day, str) and day in DAYS_OF_WEEK:
-        return [day]
-
-    return []
+    for schedule in candidates:
+        try:
+            compiled = compile_schedule_strict(schedule)
+        except ValueError:
+            continue
+        if compiled.next_after(utc_now()) is not None:
+            return schedule
+    return None
 
 
 def build_days_selection_buttons():
@@ -94,17 +130,20 @@ def build_days_selection_buttons():
     ]
 
 def load_config():
-    if not os.path.exists(CONFIG_PATH):
-        return {'messages': {}}
-    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
-    if not config or 'messages' not in config:
-        return {'messages': {}}
-    return config
-
-def save_config(config):
-    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-        yaml.dump(config, f, allow_unicode=True, sort_keys=False)
+    """Cached read of the message config (re-read only when the storage changes)."""
+    return config_store.load()
+
+def put_message_config(msg_id, data):
+    config_store.put_message(msg_id, data)
+    scheduler.notify()
+
+def delete_message_config(msg_id):
+    config_store.delete_message(msg_id)
+    scheduler.notify()
+
+def clear_message_configs():
+    config_store.clear_messages()
+    scheduler.notify()
 
 @bot.on(events.NewMessage(pattern=r'/list_message|📋 List Messages'))
 @admin_only
@@ -133,6 +172,10 @@ async def list_message_handler(event):
                 weekly_days = get_weekly_days(schedule)
                 days_str = ", ".join(weekly_days) if weekly_days else "(no days selected)"
                 sched_text = f"📅 {days_str} at {schedule['time']}"
+            elif schedule['type'] == 'cron':
+                sched_text = f"🧩 Cron `{schedule.get('cron', '')}`"
+            if schedule.get('timezone'):
+                sched_text += f" ({schedule['timezone']})"
         
         response += f"🆔 **{msg_id}**\n"
         response += f"📝 {display_text}\n"
@@ -195,8 +238,7 @@ async def callback_remove_handler(event):
                     except:
                         pass
         
-        config['messages'] = {}
-        save_config(config)
+        clear_message_configs()
         
         status = "✅ All messages and media files removed."
         if total_deleted_files > 0:
@@ -217,8 +259,7 @@ async def callback_remove_handler(event):
                 except Exception as e:
                     print(f"Error deleting file {path}: {e}")
 
-        del config['messages'][msg_id]
-        save_config(config)
+        delete_message_config(msg_id)
         
         status_text = f"✅ Message **{msg_id}** removed successfully."
         if deleted_files > 0:
@@ -241,138 +282,9 @@ class State:
     WAITING_SCHEDULE_TIME = 7
     WAITING_SCHEDULE_DAY = 8
     WAITING_DELETE_KEYWORD = 9
+    WAITING_SCHEDULE_CRON = 10
 
 
-def create_user_client():
-    return TelegramClient(
-        'session',
-        int(API_ID),
-        API_HASH,
-        device_model="Windows 11",
-        system_version="10.0.22621",
-        app_version="4.11.2"
-    )
-
-
-def can_delete_for_everyone(entity):
-    if getattr(entity, 'creator', False):
-        return True
-
-    admin_rights = getattr(entity, 'admin_rights', None)
-    if admin_rights and getattr(admin_rights, 'delete_messages', False):
-        return True
-
-    return False
-
-
-def is_supported_cleanup_dialog(dialog):
-    entity = dialog.entity
-    return not getattr(entity, 'broadcast', False)
-
-
-async def delete_messages_by_keywords(keywords, protected_chat_ids=None, progress_callback=None):
-    deleted_count = 0
-    matched_count = 0
-    failed_chats = []
-    scanned_chats = 0
-    protected_chat_ids = {chat_id for chat_id in (protected_chat_ids or set()) if chat_id is not None}
-
-    user_client = create_user_client()
-    try:
-        await user_client.connect()
-        if not await user_client.is_user_authorized():
-            raise RuntimeError("User session not authorized. Use **🔑 Auth** first.")
-
-        dialogs = await user_client.get_dialogs(limit=None)
-        target_dialogs = [
-            dialog for dialog in dialogs
-            if dialog.id not in protected_chat_ids and is_supported_cleanup_dialog(dialog)
-        ]
-        total_target_chats = len(target_dialogs)
-
-        for keyword_index, keyword in enumerate(keywords, start=1):
-            scanned_chats = 0
-
-            for dialog in target_dialogs:
-                scanned_chats += 1
-                outgoing_ids_to_delete = set()
-                incoming_revoke_ids_to_delete = set()
-                incoming_local_ids_to_delete = set()
-                delete_incoming_for_everyone = can_delete_for_everyone(dialog.entity)
-
-                try:
-                    if progress_callback:
-                        await progress_callback(
-                            keyword=keyword,
-                            keyword_index=keyword_index,
-                            total_keywords=len(keywords),
-                            scanned_chats=scanned_chats,
-                            total_chats=total_target_chats,
-                            deleted_count=deleted_count
-                        )
-
-                    async for message in user_client.iter_messages(dialog.entity, search=keyword, limit=None):
-                        if (
-                            message.id in outgoing_ids_to_delete
-                            or message.id in incoming_revoke_ids_to_delete
-                            or message.id in incoming_local_ids_to_delete
-                        ):
-                            continue
-
-                        if getattr(message, 'out', False):
-                            outgoing_ids_to_delete.add(message.id)
-                        elif delete_incoming_for_everyone:
-                            incoming_revoke_ids_to_delete.add(message.id)
-                        else:
-                            incoming_local_ids_to_delete.add(message.id)
-                        matched_count += 1
-
-                        if len(outgoing_ids_to_delete) >= 100:
-                            batch_ids = list(outgoing_ids_to_delete)
-                            await user_client.delete_messages(dialog.entity, batch_ids, revoke=True)
-                            deleted_count += len(batch_ids)
-                            outgoing_ids_to_delete.clear()
-
-                        if len(incoming_revoke_ids_to_delete) >= 100:
-                            batch_ids = list(incoming_revoke_ids_to_delete)
-                            await user_client.delete_messages(dialog.entity, batch_ids, revoke=True)
-                            deleted_count += len(batch_ids)
-                            incoming_revoke_ids_to_delete.clear()
-
-                        if len(incoming_local_ids_to_delete) >= 100:
-                            batch_ids = list(incoming_local_ids_to_delete)
-                            await user_client.delete_messages(dialog.entity, batch_ids, revoke=False)
-                            deleted_count += len(batch_ids)
-                            incoming_local_ids_to_delete.clear()
-
-                    if outgoing_ids_to_delete:
-                        batch_ids = list(outgoing_ids_to_delete)
-                        await user_client.delete_messages(dialog.entity, batch_ids, revoke=True)
-                        deleted_count += len(batch_ids)
-
-                    if incoming_revoke_ids_to_delete:
-                        batch_ids = list(incoming_revoke_ids_to_delete)
-                        await user_client.delete_messages(dialog.entity, batch_ids, revoke=True)
-                        deleted_count += len(batch_ids)
-
-                    if incoming_local_ids_to_delete:
-                        batch_ids = list(incoming_local_ids_to_delete)
-                        await user_client.delete_messages(dialog.entity, batch_ids, revoke=False)
-                        deleted_count += len(batch_ids)
-
-                except Exception as e:
-                    chat_name = getattr(dialog, 'name', None) or getattr(dialog.entity, 'title', None) or str(dialog.id)
-                    failed_chats.append(f"[{keyword}] {chat_name}: {e}")
-    finally:
-        await user_client.disconnect()
-
-    return {
-        'deleted_count': deleted_count,
-        'matched_count': matched_count,
-        'scanned_chats': scanned_chats,
-        'failed_chats': failed_chats,
-    }
-
 @bot.on(events.NewMessage(pattern=r'/auth|🔑 Auth'))
 @admin_only
 async def auth_handler(event):
@@ -381,13 +293,11 @@ async def auth_handler(event):
         await event.respond("❌ PHONE_NUMBER not found in .env")
         raise events.StopPropagation
 
-    user_client = TelegramClient('session', int(API_ID), API_HASH, device_model="Windows 11", system_version="10.0.22621", app_version="4.11.2")
-    await user_client.connect()
+    user_client = await user_clients.get_client()
     
     if await user_client.is_user_authorized():
-        me = await user_client.get_me()
+        me = await user_clients.get_me()
         await event.respond(f"✅ Already authenticated as {me.first_name} (@{me.username})", buttons=MAIN_MENU)
-        await user_client.disconnect()
         raise events.StopPropagation
 
     try:
@@ -436,9 +346,10 @@ async def auth_handler(event):
                 continue
 
         if qr_authorized:
-            me = await user_client.get_me()
+            me = await user_clients.get_me(refresh=True)
             await event.respond(f"✅ Successfully authenticated via QR as {me.first_name}!", buttons=MAIN_MENU)
-            await user_client.disconnect()
+            if messages_index is not None:
+                asyncio.create_task(start_message_index())
             raise events.StopPropagation
 
         await event.respond("⌛ QR login was not completed in time. Switching to fallback code authentication...")
@@ -475,7 +386,6 @@ async def auth_handler(event):
         raise
     except Exception as e:
         await event.respond(f"❌ Error: {str(e)}", buttons=MAIN_MENU)
-        await user_client.disconnect()
     
     raise events.StopPropagation
 
@@ -536,10 +446,11 @@ async def conversation_handler(event):
         try:
             from telethon.errors import SessionPasswordNeededError
             await client.sign_in(phone, code)
-            me = await client.get_me()
+            me = await user_clients.get_me(refresh=True)
             await event.respond(f"✅ Successfully authenticated as {me.first_name}!", buttons=MAIN_MENU)
-            await client.disconnect()
             del user_states[user_id]
+            if messages_index is not None:
+                asyncio.create_task(start_message_index())
         except SessionPasswordNeededError:
             state_data['state'] = State.WAITING_AUTH_PASSWORD
             await event.respond("🔐 2FA Password needed. Please enter your password:")
@@ -549,7 +460,6 @@ async def conversation_handler(event):
                 await event.respond("❌ Telegram blocked the login because the code was entered in a chat. \n\n**Tip:** Try to run `python3 setup_auth.py` in the server console once to establish the session.", buttons=MAIN_MENU)
             else:
                 await event.respond(f"❌ Error: {error_msg}. Starting over...", buttons=MAIN_MENU)
-            await client.disconnect()
             del user_states[user_id]
         return
 
@@ -558,17 +468,17 @@ async def conversation_handler(event):
         client = state_data['client']
         try:
             await client.sign_in(password=password)
-            me = await client.get_me()
+            me = await user_clients.get_me(refresh=True)
             await event.respond(f"✅ Successfully authenticated as {me.first_name}!", buttons=MAIN_MENU)
-            await client.disconnect()
             del user_states[user_id]
+            if messages_index is not None:
+                asyncio.create_task(start_message_index())
         except Exception as e:
             error_msg = str(e)
             if "previously shared" in error_msg or "expired" in error_msg:
                 await event.respond("❌ Telegram blocked the login because the code was entered in a chat. \n\n**Tip:** Try to run `python3 setup_auth.py` in the server console once to establish the session.", buttons=MAIN_MENU)
             else:
                 await event.respond(f"❌ Error: {error_msg}. Starting over...", buttons=MAIN_MENU)
-            await client.disconnect()
             del user_states[user_id]
         return
 
@@ -579,73 +489,10 @@ async def conversation_handler(event):
             await event.respond("❌ Please send at least one non-empty word or phrase.")
             return
 
-        keywords_text = ", ".join(keywords)
-        protected_chat_ids = set()
-        status_msg = await event.respond(
-            "🧹 Started delete-by-word scan.\n\n"
-        )
-
-        last_progress_marker = {'value': None}
-        flood_wait_notified_seconds = {'value': None}
-        async def update_progress(keyword, keyword_index, total_keywords, scanned_chats, total_chats, deleted_count):
-            chats_bucket = scanned_chats // 100
-            marker = (keyword_index, chats_bucket)
-            should_update = scanned_chats == 1 or scanned_chats == total_chats
-            should_update = should_update or scanned_chats % 100 == 0
-            should_update = should_update or last_progress_marker['value'] is None
-            if not should_update or marker == last_progress_marker['value']:
-                return
-
-            last_progress_marker['value'] = marker
-            try:
-                await status_msg.edit(
-                    "🧹 Scan in progress.\n\n"
-                    f"Current keyword: {keyword_index}/{total_keywords} - `{' '.join(keyword)}`\n"
-                    f"Scanned chats: {scanned_chats}/{total_chats}\n"
-                    f"Deleted messages: {deleted_count}"
-                )
-            except FloodWaitError as e:
-                wait_seconds = int(getattr(e, 'seconds', 0) or 0)
-                if flood_wait_notified_seconds['value'] != wait_seconds:
-                    flood_wait_notified_seconds['value'] = wait_seconds
-                    await event.respond(
-                        f"⏳ Telegram limited status updates. FloodWait: {wait_seconds}s"
-                    )
-            except Exception:
-                pass
-
         try:
-            result = await delete_messages_by_keywords(
-                keywords,
-                protected_chat_ids=protected_chat_ids,
-                progress_callback=update_progress
-            )
-            del user_states[user_id]
-
-            response = (
-                "✅ Delete-by-word scan completed.\n\n"
-                f"Keywords: `{keywords_text}`\n"
-                f"Scanned chats: {result['scanned_chats']}\n"
-                f"Matched messages: {result['matched_count']}\n"
-                f"Deleted: {result['deleted_count']}"
-            )
-
-            failed_chats = result['failed_chats'][:5]
-            if failed_chats:
-                response += "\n\nSome chats could not be processed:\n"
-                response += "\n".join(f"• {item}" for item in failed_chats)
-
-            try:
-                await status_msg.edit(response, buttons=MAIN_MENU)
-            except Exception:
-                await event.respond(response, buttons=MAIN_MENU)
-        except Exception as e:
-            del user_states[user_id]
-            error_text = f"❌ Delete-by-word scan failed: {e}"
-            try:
-                await status_msg.edit(error_text, buttons=MAIN_MENU)
-            except Exception:
-                await event.respond(error_text, buttons=MAIN_MENU)
+            await run_delete_by_word(event.chat_id, keywords)
+        finally:
+            user_states.pop(user_id, None)
         return
 
     # --- Add Message Flow ---
@@ -671,7 +518,15 @@ async def conversation_handler(event):
             path = await event.download_media(file=filename)
             
             if path:
-                state_data['data']['image_paths'].append(os.path.abspath(path))
+                image_paths = state_data['data']['image_paths']
+                path = os.path.abspath(path)
+                image_paths.append(path)
+                # Photos are downscaled, stripped of metadata and recompressed once, so sends
+                # upload the small copy (replaced in place to keep the album order).
+                # Files sent as documents are kept byte for byte.
+                if isinstance(event.media, MessageMediaPhoto):
+                    optimized = await image_pipeline.optimize_image(path)
+                    image_paths[image_paths.index(path)] = optimized
                 
                 # If it's part of an album, wait a bit to group responses
                 if event.grouped_id:
@@ -704,6 +559,7 @@ async def conversation_handler(event):
         
         buttons = [
             [Button.inline("⏰ Daily", data="sched_daily"), Button.inline("📅 Weekly", data="sched_weekly")],
+            [Button.inline("🧩 Cron", data="sched_cron")],
             [Button.inline("🚫 No Schedule (Manual)", data="sched_none")]
         ]
         await event.respond("Step 4: Choose a **schedule** for this message:", buttons=buttons)
@@ -725,6 +581,16 @@ async def conversation_handler(event):
         else:
             await event.respond("❌ Invalid time format. Please use **H:MM** or **HH:MM** (e.g., `9:00` or `09:00`):")
 
+    elif current_state == State.WAITING_SCHEDULE_CRON:
+        schedule = parse_cron_input(event.text)
+        if schedule:
+            state_data['data']['schedule'] = schedule
+            await finalize_add_message(event, user_id, state_data)
+        else:
+            await event.respond(
+                "❌ Invalid cron expression or timezone. Example: `0 9 * * 1-5` or `0 9 * * 1-5 Europe/Lisbon`"
+            )
+
     elif current_state == State.WAITING_SCHEDULE_DAY:
         selected_day = event.text.strip()
         if selected_day == "✅ Done":
@@ -770,12 +636,27 @@ async def finalize_add_message(event, user_id, state_data):
     while new_id in existing_ids:
         new_id = f"MESSAGE_{int(new_id.split('_')[1]) + 1}"
         
-    config['messages'][new_id] = state_data['data']
-    save_config(config)
+    put_message_config(new_id, state_data['data'])
     
     del user_states[user_id]
     await event.respond(f"✅ Successfully added message **{new_id}**!", buttons=MAIN_MENU)
 
+    # Resolve recipients now, so scheduled sends don't need any lookups
+    asyncio.create_task(prewarm_message_entities(new_id))
+
+async def prewarm_message_entities(msg_id):
+    message = config_store.load_messages().get(msg_id)
+    if message is None or not message.recipients:
+        return
+    try:
+        await user_clients.get_authorized_client()
+        sender = TelegramSender(log_func=lambda text: print(f"[{msg_id}] {text}"), client_manager=user_clients, account_pool=account_pool)
+        failed = await sender.prewarm_entities(message)
+        if failed:
+            await bot.send_message(ADMIN_ID, f"⚠ {failed} recipient(s) of **{msg_id}** could not be resolved. Check the IDs/usernames.")
+    except Exception as e:
+        print(f"⚠ Could not pre-resolve recipients of {msg_id}: {e}")
+
 @bot.on(events.CallbackQuery(data=lambda d: d.startswith(b'sched_')))
 @admin_only
 async def schedule_type_handler(event):
@@ -796,6 +677,13 @@ async def schedule_type_handler(event):
         user_states[user_id]['data']['schedule'] = {'type': 'weekly', 'time': '', 'days': []}
         user_states[user_id]['state'] = State.WAITING_SCHEDULE_TIME
         await event.edit("Step 5: Send me the **time** for weekly post (format **H:MM** or **HH:MM**, e.g., 9:00 or 18:00):")
+    elif data == "sched_cron":
+        user_states[user_id]['state'] = State.WAITING_SCHEDULE_CRON
+        await event.edit(
+            "Step 5: Send me a **cron expression** (minute hour day month weekday), "
+            "optionally followed by a timezone.\n\n"
+            "Examples: `0 9 * * 1-5`, `30 18 * * fri Europe/Lisbon`, `@daily`"
+        )
 
 @bot.on(events.CallbackQuery(data="skip_images"))
 @admin_only
@@ -813,9 +701,8 @@ async def skip_images_handler(event):
 async def find_group_id_handler(event):
     await event.respond("🔍 Finding your groups, channels, and chats... Please wait.")
     
-    user_client = TelegramClient('session', int(API_ID), API_HASH)
     try:
-        await user_client.connect()
+        user_client = await user_clients.get_client()
         if not await user_client.is_user_authorized():
             await event.respond("❌ User session is not authorized. Please run `python setup_auth.py` on the server.")
             return
@@ -881,8 +768,6 @@ async def find_group_id_handler(event):
     except Exception as e:
         if str(e):
             await event.respond(f"❌ Error: {str(e)}", buttons=MAIN_MENU)
-    finally:
-        await user_client.disconnect()
 
 @bot.on(events.NewMessage(pattern=r'/send_now|🚀 Send Now'))
 @admin_only
@@ -913,8 +798,7 @@ async def callback_send_handler(event):
     data = event.data.decode()
     msg_id = data.split('_', 1)[1]
     
-    config = load_config()
-    messages = config.get('messages', {})
+    messages = config_store.load_messages()
     
     target_config = None
     if msg_id != "all":
@@ -936,15 +820,13 @@ async def callback_send_handler(event):
                 pass
 
     try:
-        sender = TelegramSender(log_func=log_to_chat)
-        await sender.client.connect()
-        if not await sender.client.is_user_authorized():
+        user_client = await user_clients.get_client()
+        if not await user_client.is_user_authorized():
             await event.respond("❌ User session not authorized. Use **🔑 Auth** button.")
-            await sender.client.disconnect()
             return
 
+        sender = TelegramSender(log_func=log_to_chat, client_manager=user_clients, outbox=outbox, account_pool=account_pool)
         await sender.send_messages(specific_config=target_config)
-        await sender.client.disconnect()
         
         final_log = "\n".join(logs)
         if len(final_log) > 3000:
@@ -961,77 +843,301 @@ async def callback_send_handler(event):
 
 async def scheduler_loop():
     print("Scheduler started...")
+    ledger = FireLedger()
+    workers = WorkerPool(concurrency=SCHEDULER_CONCURRENCY, timeout=SCHEDULER_JOB_TIMEOUT)
+    # Pre-warming has slots of its own, so it never holds up a due post
+    prewarm_workers = WorkerPool(concurrency=SCHEDULER_CONCURRENCY, timeout=SCHEDULER_JOB_TIMEOUT)
+    ledger.prune()
+
+    # Catch up on slots missed while the bot was down, within the grace window
+    now = utc_now()
+    grace_start = now - get_grace_window()
+    watermark = ledger.get_watermark()
+    scheduler.resume_from(max(watermark, grace_start) if watermark else now)
+    interrupted = ledger.recover_interrupted(since=grace_start)
+
+    loaded_version = None
     while True:
         try:
-            now = datetime.now()
-            current_time = now.strftime("%H:%M")
-            current_day = now.strftime("%A")
-            
-            config = load_config()
-            messages = config.get('messages', {})
-            
-            for msg_id, data in messages.items():
-                schedule = data.get('schedule')
-                if not schedule:
+            # Rebuild the heap only when the stored messages actually changed
+            version = config_store.current_version()
+            if version != loaded_version:
+                scheduler.load(config_store.scheduled_messages())
+                loaded_version = config_store.version
+                print(f"📅 Scheduler: {len(scheduler)} scheduled message(s) loaded")
+
+            # Slots that were claimed but never finished before a crash
+            for msg_id, fire_time in interrupted:
+                print(f"♻️ Scheduler: Retrying interrupted {msg_id} (due {fire_time.astimezone():%Y-%m-%d %H:%M})")
+                scheduler.add_catch_up(msg_id, fire_time)
+            interrupted = []
+
+            # Get upcoming posts ready, so their fire time only has the send calls left
+            for msg_id, fire_time, message in scheduler.pop_prewarm():
+                prewarm_workers.submit(prewarm_scheduled_task(prewarm_workers, msg_id, message))
+
+            # Everything due in this pass goes out as one delivery plan
+            batch = []
+            for msg_id, fire_time, message in scheduler.pop_due():
+                if not ledger.claim(msg_id, fire_time):
+                    print(f"⏭ Scheduler: {msg_id} already sent for {fire_time.astimezone():%Y-%m-%d %H:%M}, skipping")
                     continue
-                
-                should_send = False
-                if schedule['type'] == 'daily' and schedule['time'] == current_time:
-                    should_send = True
-                elif schedule['type'] == 'weekly' and schedule['time'] == current_time:
-                    weekly_days = get_weekly_days(schedule)
-                    if current_day in weekly_days:
-                        should_send = True
-                
-                if should_send:
-                    print(f"⏰ Scheduler: Sending {msg_id}...")
-                    # Small delay to avoid double sending in the same minute if processing is too fast
-                    # although the loop waits 60s at the end
-                    
-                    try:
-                        # We use a helper function to send so we can log to admin
-                        await run_scheduled_task(msg_id, data)
-                    except Exception as e:
-                        print(f"❌ Scheduler error sending {msg_id}: {e}")
-                        await bot.send_message(ADMIN_ID, f"❌ **Scheduled Post Failed**: {msg_id}\nError: {e}")
-            
-            # Wait for the next minute start
-            await asyncio.sleep(60)
+
+                print(f"⏰ Scheduler: Sending {msg_id} (due {fire_time.astimezone():%Y-%m-%d %H:%M})...")
+                batch.append((msg_id, fire_time, message))
+            if batch:
+                workers.submit(dispatch_scheduled_batch(workers, ledger, batch))
+            ledger.set_watermark(scheduler.checked_until)
+
+            # Sleep until the earliest deadline (or until the config changes)
+            await scheduler.wait()
         except Exception as e:
             print(f"❌ Scheduler loop error: {e}")
             await asyncio.sleep(60)
 
-async def run_scheduled_task(msg_id, data):
+async def dispatch_scheduled_batch(workers, ledger, batch):
+    """
+    Send the (msg_id, fire_time, message) entries due together in a worker slot.
+    Each message has SCHEDULER_JOB_TIMEOUT seconds of its own and its outcome is
+    recorded in the ledger separately.
+    """
+    names = ", ".join(msg_id for msg_id, _, _ in batch)
+    try:
+        # Messages time out individually inside the plan; this only guards against a hung batch
+        timed_out = await workers.run(run_scheduled_batch(batch), timeout=SCHEDULER_JOB_TIMEOUT * len(batch))
+    except asyncio.TimeoutError:
+        for msg_id, fire_time, _ in batch:
+            ledger.fail(msg_id, fire_time, "timeout")
+        print(f"❌ Scheduler timeout sending {names} after {SCHEDULER_JOB_TIMEOUT * len(batch)}s")
+        await bot.send_message(ADMIN_ID, f"❌ **Scheduled Post Failed**: {names}\nError: timed out after {SCHEDULER_JOB_TIMEOUT * len(batch)}s")
+        return
+    except Exception as e:
+        for msg_id, fire_time, _ in batch:
+            ledger.fail(msg_id, fire_time, e)
+        print(f"❌ Scheduler error sending {names}: {e}")
+        await bot.send_message(ADMIN_ID, f"❌ **Scheduled Post Failed**: {names}\nError: {e}")
+        return
+
+    for (msg_id, fire_time, _), message_timed_out in zip(batch, timed_out):
+        if message_timed_out:
+            ledger.fail(msg_id, fire_time, "timeout")
+        else:
+            ledger.complete(msg_id, fire_time)
+    late = [msg_id for (msg_id, _, _), message_timed_out in zip(batch, timed_out) if message_timed_out]
+    if late:
+        print(f"❌ Scheduler timeout sending {', '.join(late)} after {SCHEDULER_JOB_TIMEOUT}s")
+        await bot.send_message(
+            ADMIN_ID,
+            f"❌ **Scheduled Post Timed Out**: {', '.join(late)}\nUnsent recipients are retried from the outbox."
+        )
+
+async def prewarm_scheduled_task(workers, msg_id, message):
+    """Pre-warm a scheduled post in a worker slot, within SCHEDULER_JOB_TIMEOUT."""
+    try:
+        await workers.run(prewarm_scheduled_message(msg_id, message))
+    except asyncio.TimeoutError:
+        print(f"⚠ Scheduler: Pre-warming {msg_id} timed out after {SCHEDULER_JOB_TIMEOUT}s")
+
+async def prewarm_scheduled_message(msg_id, message):
+    """Connect, resolve recipients and upload media ahead of a scheduled post."""
+    try:
+        await user_clients.get_me()
+        sender = TelegramSender(
+            log_func=lambda text: print(f"[{msg_id}] {text}"),
+            client_manager=user_clients,
+            account_pool=account_pool
+        )
+        failed = await sender.prewarm(message)
+        print(f"🔥 Scheduler: {msg_id} pre-warmed" + (f" ({failed} recipient(s) unresolved)" if failed else ""))
+    except Exception as e:
+        print(f"⚠ Scheduler: Could not pre-warm {msg_id}: {e}")
+
+async def run_scheduled_batch(batch):
+    """
+    Send a due batch and report to the admin. Returns whether each message timed out.
+    Raises RuntimeError if the user session is not authorized; the recipients are
+    then queued in the outbox, which delivers them once the session is back.
+    """
+    names = ", ".join(msg_id for msg_id, _, _ in batch)
     logs = []
     def logger(text):
-        print(f"[{msg_id}] {text}")
+        print(f"[{names}] {text}")
         logs.append(text)
 
-    sender = TelegramSender(log_func=logger)
-    await sender.client.connect()
+    user_client = await user_clients.get_client()
     
-    if await sender.client.is_user_authorized():
+    if await user_client.is_user_authorized():
         # Double check it's a user session
-        me = await sender.client.get_me()
+        me = await user_clients.get_me()
         if getattr(me, 'bot', False):
             await bot.send_message(ADMIN_ID, f"⚠ **WARNING**: Scheduler is using a BOT account (@{me.username}) instead of user!")
         
-        await sender.send_messages(specific_config=data)
-        await sender.client.disconnect()
+        sender = TelegramSender(log_func=logger, client_manager=user_clients, outbox=outbox, account_pool=account_pool)
+        outcomes = await sender.send_scheduled(
+            [(message, slot_key(fire_time)) for _, fire_time, message in batch],
+            timeout=SCHEDULER_JOB_TIMEOUT
+        )
         
         # Notify admin with log summary
-        log_summary = "\n".join(logs[-5:]) # Last 5 lines
-        await bot.send_message(ADMIN_ID, f"⏰ **Scheduled Post Sent**: {msg_id}\n\n```{log_summary}```")
+        log_summary = "\n".join(logs[-(4 + len(batch)):]) # Per-message summaries and total
+        await bot.send_message(ADMIN_ID, f"⏰ **Scheduled Post Sent**: {names}\n\n```{log_summary}```")
+        return [timed_out for _, _, timed_out in outcomes]
     else:
-        await bot.send_message(ADMIN_ID, f"❌ **Scheduled Post Failed**: {msg_id}\nUser session not authorized! Please re-auth.")
-        await sender.client.disconnect()
+        # Nothing was sent, so the ledger must not record the slots as delivered
+        for _, fire_time, message in batch:
+            if message.recipients:
+                outbox.enqueue(message.msg_id, slot_key(fire_time), [r.raw for r in message.recipients])
+        raise RuntimeError("User session not authorized! Please re-auth.")
+
+async def outbox_loop():
+    """Retry failed deliveries from the outbox once their backoff has passed."""
+    outbox.prune()
+    while True:
+        try:
+            due = outbox.due_deliveries()
+            if due and await (await user_clients.get_client()).is_user_authorized():
+                messages = config_store.load_messages()
+                for msg_id, slot in due:
+                    message = messages.get(msg_id)
+                    if message is None:
+                        outbox.drop(msg_id, slot, "message removed")
+                        continue
+                    await run_outbox_retry(msg_id, slot, message)
+
+            delay = outbox.next_attempt_in()
+            await asyncio.sleep(min(delay, 60) if delay is not None else 60)
+        except Exception as e:
+            print(f"❌ Outbox loop error: {e}")
+            await asyncio.sleep(60)
+
+async def run_outbox_retry(msg_id, slot, message):
+    logs = []
+    def logger(text):
+        print(f"[{msg_id}] {text}")
+        logs.append(text)
+
+    sender = TelegramSender(log_func=logger, client_manager=user_clients, outbox=outbox, account_pool=account_pool)
+    try:
+        sent, failed = await asyncio.wait_for(sender.retry_from_outbox(message, slot), SCHEDULER_JOB_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"❌ Outbox retry of {msg_id} timed out after {SCHEDULER_JOB_TIMEOUT}s")
+        return
+    if sent or failed:
+        log_summary = "\n".join(logs[-5:])
+        await bot.send_message(ADMIN_ID, f"🔁 **Retry**: {msg_id} ({sent} sent, {failed} failed)\n\n```{log_summary}```")
+
+async def run_delete_by_word(chat_id, keywords, mode=None):
+    """Run a delete-by-word job, reporting progress and the result to `chat_id`."""
+    keywords_text = ", ".join(keywords)
+    protected_chat_ids = set()
+    status_msg = await bot.send_message(
+        chat_id,
+        "🧹 Started delete-by-word scan.\n\n"
+    )
+
+    last_progress_marker = {'value': None}
+    flood_wait_notified_seconds = {'value': None}
+    async def update_progress(keyword, keyword_index, total_keywords, scanned_chats, total_chats, deleted_count):
+        chats_bucket = scanned_chats // 100
+        marker = (keyword_index, chats_bucket)
+        should_update = scanned_chats == 1 or scanned_chats == total_chats
+        should_update = should_update or scanned_chats % 100 == 0
+        should_update = should_update or last_progress_marker['value'] is None
+        if not should_update or marker == last_progress_marker['value']:
+            return
+
+        last_progress_marker['value'] = marker
+        # Never hold up the scan for a status edit while edits are backed off
+        if bot.governor.backoff_remaining('messages.EditMessageRequest') > 0:
+            return
+        try:
+            await status_msg.edit(
+                "🧹 Scan in progress.\n\n"
+                f"Current keyword: {keyword_index}/{total_keywords} - `{keyword}`\n"
+                f"Scanned chats: {scanned_chats}/{total_chats}\n"
+                f"Deleted messages: {deleted_count}"
+            )
+        except FloodWaitError as e:
+            wait_seconds = int(getattr(e, 'seconds', 0) or 0)
+            if flood_wait_notified_seconds['value'] != wait_seconds:
+                flood_wait_notified_seconds['value'] = wait_seconds
+                await bot.send_message(
+                    chat_id,
+                    f"⏳ Telegram limited status updates. FloodWait: {wait_seconds}s"
+                )
+        except Exception:
+            pass
+
+    try:
+        result = await delete_messages_by_keywords(
+            await user_clients.get_authorized_client(),
+            keywords,
+            protected_chat_ids=protected_chat_ids,
+            progress_callback=update_progress,
+            mode=mode,
+            checkpoints=cleanup_checkpoints,
+            index=messages_index
+        )
+
+        response = (
+            "✅ Delete-by-word scan completed.\n\n"
+            f"Keywords: `{keywords_text}`\n"
+            f"Scanned chats: {result['scanned_chats']}\n"
+            f"Matched messages: {result['matched_count']}\n"
+            f"Deleted: {result['deleted_count']}"
+        )
+        if result['resumed']:
+            response += "\n♻️ Resumed from the previous run's checkpoint"
+
+        failed_chats = result['failed_chats'][:5]
+        if failed_chats:
+            response += "\n\nSome chats could not be processed:\n"
+            response += "\n".join(f"• {item}" for item in failed_chats)
+            response += "\n\nSend the same words again to retry only what is left."
+
+        try:
+            await status_msg.edit(response, buttons=MAIN_MENU)
+        except Exception:
+            await bot.send_message(chat_id, response, buttons=MAIN_MENU)
+    except Exception as e:
+        error_text = f"❌ Delete-by-word scan failed: {e}"
+        try:
+            await status_msg.edit(error_text, buttons=MAIN_MENU)
+        except Exception:
+            await bot.send_message(chat_id, error_text, buttons=MAIN_MENU)
+
+async def resume_cleanup_jobs():
+    """Continue delete-by-word jobs that were interrupted by a restart."""
+    for keywords, mode in cleanup_checkpoints.interrupted_jobs():
+        await bot.send_message(ADMIN_ID, f"♻️ Resuming interrupted delete-by-word scan: `{', '.join(keywords)}`")
+        await run_delete_by_word(ADMIN_ID, keywords, mode=mode)
+
+async def start_message_index():
+    """Keep the message index current on the user client and backfill it."""
+    try:
+        client = await user_clients.get_authorized_client()
+    except Exception as e:
+        print(f"⚠ Message index not started: {e}")
+        return
+    messages_index.attach(client)
+    await messages_index.sync(client)
 
 async def main():
     await bot.start(bot_token=BOT_TOKEN)
     print("Bot Manager started...")
-    # Start scheduler in background
+    # Start scheduler and outbox retries in background
     asyncio.create_task(scheduler_loop())
-    await bot.run_until_disconnected()
+    asyncio.create_task(outbox_loop())
+    asyncio.create_task(resume_cleanup_jobs())
+    if messages_index is not None:
+        asyncio.create_task(start_message_index())
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        await account_pool.disconnect()
+        image_pipeline.shutdown()
 
 if __name__ == '__main__':
+    # Fork the image workers before the event loop (and its threads) exist
+    image_pipeline.start()
     asyncio.run(main())
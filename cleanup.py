@@ -0,0 +1,495 @@
+"""
+Delete-by-word cleanup for the user account.
+Outgoing matches are deleted for everyone; incoming matches are deleted for
+everyone where the account has that permission, otherwise only for itself.
+
+Two scan modes (CLEANUP_SCAN_MODE):
+- history (default): every chat is walked once and all keywords are matched
+  together locally (NFKC + casefold, word-prefix match like Telegram search).
+  Where incoming messages cannot be deleted, only the account's own messages
+  are walked.
+- search: one server-side search per (keyword, chat).
+Deletions are always sent in batches of 100.
+
+Chats are scanned by CLEANUP_CONCURRENCY workers sharing the user client;
+its FloodGovernor paces them, and a FloodWait that is too long for the
+governor is waited out before the chat is scanned again.
+
+With a CleanupCheckpoints store, progress is saved per chat (last scanned
+message ID and counts). Running the same keywords again, or restarting the
+bot mid-job, skips finished chats and continues partial ones where they
+stopped. A job that completes without errors clears its checkpoints.
+
+Chats covered by a MessageIndex are not scanned at all: their matches come
+from the local index, are checked against the messages' current text (one
+request per 100 hits) and only the delete requests are sent.
+
+Other chats are prefiltered (CLEANUP_PREFILTER) with Telegram's account-wide
+search, so only chats where a keyword occurs are visited at all.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Chat
+
+import state_db
+from scheduler import WorkerPool
+
+DELETE_BATCH_SIZE = 100
+SCAN_MODES = ('history', 'search')
+DEFAULT_CONCURRENCY = 4
+
+# Pending deletions are flushed and progress saved every this many scanned messages
+CHECKPOINT_EVERY = 500
+# Hours the checkpoints of an unfinished job are kept
+DEFAULT_CHECKPOINT_TTL_HOURS = 168
+
+
+def get_scan_mode():
+    mode = os.getenv('CLEANUP_SCAN_MODE', 'history').strip().lower()
+    return mode if mode in SCAN_MODES else 'history'
+
+
+def prefilter_enabled():
+    return os.getenv('CLEANUP_PREFILTER', 'true').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def normalize_text(text):
+    """NFKC + casefold with runs of whitespace collapsed, so matching ignores case, width and spacing."""
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+class KeywordMatcher:
+    """Matches any of the keywords in one pass over a text."""
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        normalized = sorted({normalize_text(k) for k in self.keywords if k.strip()}, key=len, reverse=True)
+        # Longest first, so overlapping keywords match the longer phrase
+        self._pattern = re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, normalized)) + ')')
+
+    def matches(self, text):
+        return bool(text) and self._pattern.search(normalize_text(text)) is not None
+
+
+def job_key(keywords, mode):
+    """Identifies a job by scan mode and keyword set, ignoring order, case and spacing."""
+    normalized = sorted({normalize_text(k) for k in keywords if k.strip()})
+    return hashlib.sha1('\n'.join([mode, *normalized]).encode('utf-8')).hexdigest()
+
+
+class ChatCheckpoint:
+    """Saved progress of one pass over one chat."""
+
+    def __init__(self, store, job, pass_key, chat_id, last_id=0, deleted=0, done=False):
+        self.store = store
+        self.job = job
+        self.pass_key = pass_key
+        self.chat_id = chat_id
+        self.last_id = last_id
+        self.deleted = deleted
+        self.done = done
+
+    def update(self, last_id, deleted, done=False):
+        self.last_id, self.deleted, self.done = last_id, deleted, done
+        self.store.save(self)
+
+
+class CleanupCheckpoints:
+    def __init__(self, path=None, ttl=None):
+        self.conn = state_db.connect(path)
+        self.ttl = float(ttl if ttl is not None else os.getenv('CLEANUP_CHECKPOINT_TTL', DEFAULT_CHECKPOINT_TTL_HOURS)) * 3600
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cleanup_jobs (
+                job_key TEXT PRIMARY KEY,
+                keywords TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cleanup_checkpoints (
+                job_key TEXT NOT NULL,
+                pass_key TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                deleted INTEGER NOT NULL,
+                done INTEGER NOT NULL,
+                PRIMARY KEY (job_key, pass_key, chat_id)
+            )
+        """)
+        self.prune()
+
+    def start(self, keywords, mode):
+        """
+        Register a job and return (job key, saved checkpoints by (pass key, chat ID)).
+        Checkpoints are empty for a new job.
+        """
+        job = job_key(keywords, mode)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cleanup_jobs (job_key, keywords, mode, status, updated_at) VALUES (?, ?, ?, 'running', ?)",
+            (job, json.dumps(list(keywords), ensure_ascii=False), mode, time.time())
+        )
+        rows = self.conn.execute(
+            "SELECT pass_key, chat_id, last_id, deleted, done FROM cleanup_checkpoints WHERE job_key = ?",
+            (job,)
+        ).fetchall()
+        return job, {
+            (pass_key, chat_id): ChatCheckpoint(self, job, pass_key, chat_id, last_id, deleted, bool(done))
+            for pass_key, chat_id, last_id, deleted, done in rows
+        }
+
+    def save(self, checkpoint):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cleanup_checkpoints "
+            "(job_key, pass_key, chat_id, last_id, deleted, done) VALUES (?, ?, ?, ?, ?, ?)",
+            (checkpoint.job, checkpoint.pass_key, checkpoint.chat_id, checkpoint.last_id,
+             checkpoint.deleted, int(checkpoint.done))
+        )
+        self.conn.execute("UPDATE cleanup_jobs SET updated_at = ? WHERE job_key = ?", (time.time(), checkpoint.job))
+
+    def finish(self, job, complete):
+        """Forget a completed job; keep an incomplete one so running it again resumes it."""
+        if complete:
+            self.conn.execute("DELETE FROM cleanup_checkpoints WHERE job_key = ?", (job,))
+            self.conn.execute("DELETE FROM cleanup_jobs WHERE job_key = ?", (job,))
+        else:
+            self.conn.execute(
+                "UPDATE cleanup_jobs SET status = 'incomplete', updated_at = ? WHERE job_key = ?", (time.time(), job)
+            )
+
+    def interrupted_jobs(self):
+        """(keywords, mode) of jobs that were still running when the bot stopped (not ones that failed)."""
+        rows = self.conn.execute(
+            "SELECT keywords, mode FROM cleanup_jobs WHERE status = 'running' ORDER BY updated_at"
+        ).fetchall()
+        return [(json.loads(keywords), mode) for keywords, mode in rows]
+
+    def prune(self):
+        # Old checkpoints would skip everything posted since, so they expire
+        cutoff = time.time() - self.ttl
+        self.conn.execute(
+            "DELETE FROM cleanup_checkpoints WHERE job_key IN (SELECT job_key FROM cleanup_jobs WHERE updated_at < ?)",
+            (cutoff,)
+        )
+        self.conn.execute("DELETE FROM cleanup_jobs WHERE updated_at < ?", (cutoff,))
+
+
+def can_delete_for_everyone(entity):
+    if getattr(entity, 'creator', False):
+        return True
+
+    admin_rights = getattr(entity, 'admin_rights', None)
+    if admin_rights and getattr(admin_rights, 'delete_messages', False):
+        return True
+
+    return False
+
+
+def can_delete_incoming(dialog):
+    """Incoming messages can be deleted in private chats, basic groups and where we are admin."""
+    return dialog.is_user or isinstance(dialog.entity, Chat) or can_delete_for_everyone(dialog.entity)
+
+
+def is_supported_cleanup_dialog(dialog):
+    entity = dialog.entity
+    return not getattr(entity, 'broadcast', False)
+
+
+def dialog_name(dialog):
+    return getattr(dialog, 'name', None) or getattr(dialog.entity, 'title', None) or str(dialog.id)
+
+
+class DeleteBatcher:
+    """Collects message IDs of one chat and deletes them in batches."""
+
+    def __init__(self, client, entity, stats):
+        self.client = client
+        self.entity = entity
+        self.stats = stats
+        self._pending = {True: [], False: []}  # revoke -> ids
+
+    async def add(self, message_id, revoke):
+        batch = self._pending[revoke]
+        batch.append(message_id)
+        if len(batch) >= DELETE_BATCH_SIZE:
+            await self._delete(revoke)
+
+    async def flush(self):
+        for revoke in (True, False):
+            if self._pending[revoke]:
+                await self._delete(revoke)
+
+    async def _delete(self, revoke):
+        batch_ids = self._pending[revoke]
+        self._pending[revoke] = []
+        await self.client.delete_messages(self.entity, batch_ids, revoke=revoke)
+        self.stats['deleted_count'] += len(batch_ids)
+
+
+async def scan_chat(client, dialog, stats, keyword=None, matcher=None, checkpoint=None):
+    """
+    Find and delete the matches in one chat, either for a single `keyword`
+    (server-side search) or for all keywords of `matcher` (history walk).
+    Counters in `stats` are updated as deletions happen. With a `checkpoint`
+    the scan starts below its last message ID and saves its progress.
+    """
+    entity = dialog.entity
+    delete_incoming_for_everyone = can_delete_for_everyone(entity)
+    batcher = DeleteBatcher(client, entity, stats)
+    seen_ids = set()
+    offset_id = checkpoint.last_id if checkpoint is not None else 0
+
+    if matcher is not None:
+        from_user = None if can_delete_incoming(dialog) else 'me'
+        messages = client.iter_messages(entity, from_user=from_user, offset_id=offset_id, limit=None)
+    else:
+        messages = client.iter_messages(entity, search=keyword, offset_id=offset_id, limit=None)
+
+    base_deleted = checkpoint.deleted if checkpoint is not None else 0
+
+    def save_checkpoint(last_id, done=False):
+        checkpoint.update(last_id, base_deleted + stats['deleted_count'], done=done)
+
+    scanned = 0
+    async for message in messages:
+        scanned += 1
+        if message.id not in seen_ids and (matcher is None or matcher.matches(message.message)):
+            seen_ids.add(message.id)
+            stats['matched_count'] += 1
+
+            deleted_before = stats['deleted_count']
+            if getattr(message, 'out', False):
+                await batcher.add(message.id, revoke=True)
+            else:
+                await batcher.add(message.id, revoke=delete_incoming_for_everyone)
+            if checkpoint is not None and stats['deleted_count'] != deleted_before:
+                # A full batch went out: keep the count, the offset only moves once all pending ones are deleted
+                save_checkpoint(checkpoint.last_id)
+
+        if checkpoint is not None and scanned % CHECKPOINT_EVERY == 0:
+            # This message is handled too, so after the flush nothing from it upwards is left;
+            # the resumed scan (offset_id is exclusive) starts right below it
+            await batcher.flush()
+            save_checkpoint(message.id)
+
+    await batcher.flush()
+    if checkpoint is not None:
+        save_checkpoint(checkpoint.last_id, done=True)
+
+
+def _merge(totals, stats, matched=None):
+    totals['deleted_count'] += stats['deleted_count']
+    totals['matched_count'] += stats['matched_count'] if matched is None else matched
+
+
+async def scan_dialog(client, dialog, totals, keyword=None, matcher=None, checkpoint=None):
+    """
+    scan_chat() with counters of its own that are merged into `totals`.
+    After a FloodWait the chat is scanned again once (from its checkpoint,
+    if any); matches of the interrupted attempt count only as far as they
+    were deleted. A chat whose checkpoint is done is skipped.
+    """
+    if checkpoint is not None and checkpoint.done:
+        return
+    for attempt in (1, 2):
+        stats = {'deleted_count': 0, 'matched_count': 0}
+        try:
+            await scan_chat(client, dialog, stats, keyword=keyword, matcher=matcher, checkpoint=checkpoint)
+        except FloodWaitError as e:
+            if attempt == 2:
+                _merge(totals, stats)
+                raise
+            _merge(totals, stats, matched=stats['deleted_count'])
+            await asyncio.sleep(e.seconds)
+            continue
+        except Exception:
+            _merge(totals, stats)
+            raise
+        _merge(totals, stats)
+        return
+
+
+async def still_matching(client, dialog, hits, index, matcher):
+    """
+    The `hits` whose message still exists and still matches `matcher`. The index
+    can be behind edits and deletions made while the bot was offline; such
+    entries are corrected instead of deleted.
+    """
+    message_ids = [message_id for message_id, _ in hits]
+    current = {}
+    for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        for message in await client.get_messages(dialog.entity, ids=message_ids[start:start + DELETE_BATCH_SIZE]):
+            if message is not None:
+                current[message.id] = message
+
+    matching = []
+    for message_id, out in hits:
+        message = current.get(message_id)
+        if message is None:
+            index.remove(dialog.id, [message_id])
+        elif not matcher.matches(message.message):
+            index.add(dialog.id, message)
+        else:
+            matching.append((message_id, out))
+    return matching
+
+
+async def delete_indexed(client, dialog, totals, hits, index, matcher, checkpoint=None):
+    """
+    Delete the matches `hits` ([(msg_id, out), ...]) that `index` found in one
+    chat, without fetching its history. Deleted messages leave the index.
+    """
+    if checkpoint is not None and checkpoint.done:
+        return
+    hits = await still_matching(client, dialog, hits, index, matcher)
+    entity = dialog.entity
+    delete_incoming_for_everyone = can_delete_for_everyone(entity)
+    delete_incoming = can_delete_incoming(dialog)
+    stats = {'deleted_count': 0, 'matched_count': 0}
+    batcher = DeleteBatcher(client, entity, stats)
+    message_ids = []
+
+    try:
+        for message_id, out in hits:
+            if not out and not delete_incoming:
+                continue
+            stats['matched_count'] += 1
+            message_ids.append(message_id)
+            await batcher.add(message_id, revoke=True if out else delete_incoming_for_everyone)
+        await batcher.flush()
+    finally:
+        _merge(totals, stats)
+
+    index.remove(dialog.id, message_ids)
+    if checkpoint is not None:
+        checkpoint.update(checkpoint.last_id, checkpoint.deleted + stats['deleted_count'], done=True)
+
+
+async def chats_with_hits(client, keywords):
+    """
+    {keyword: IDs of the chats where it occurs}, from account-wide search
+    (messages.SearchGlobal, paged through by iter_messages).
+    """
+    found = {}
+    for keyword in keywords:
+        chat_ids = found[keyword] = set()
+        async for message in client.iter_messages(None, search=keyword, limit=None):
+            chat_ids.add(message.chat_id)
+    return found
+
+
+async def delete_messages_by_keywords(client, keywords, protected_chat_ids=None, progress_callback=None, mode=None,
+                                      concurrency=None, checkpoints=None, index=None, prefilter=None):
+    mode = mode or get_scan_mode()
+    stats = {'deleted_count': 0, 'matched_count': 0}
+    job, saved = checkpoints.start(keywords, mode) if checkpoints is not None else (None, {})
+    resumed = bool(saved)
+    # Counts of a resumed job include what earlier runs already deleted
+    for checkpoint in saved.values():
+        stats['deleted_count'] += checkpoint.deleted
+        stats['matched_count'] += checkpoint.deleted
+    failed_chats = []
+    progress = {'scanned_chats': 0, 'total_chats': 0}
+    workers = WorkerPool(concurrency=concurrency or int(os.getenv('CLEANUP_CONCURRENCY', DEFAULT_CONCURRENCY)), timeout=None)
+    protected_chat_ids = {chat_id for chat_id in (protected_chat_ids or set()) if chat_id is not None}
+
+    try:
+        dialogs = await client.get_dialogs(limit=None)
+        target_dialogs = [
+            dialog for dialog in dialogs
+            if dialog.id not in protected_chat_ids and is_supported_cleanup_dialog(dialog)
+        ]
+        indexed_chats = index.indexed_chats() if index is not None else set()
+
+        # Chats with a server-side hit per keyword; None visits every chat
+        keyword_chats = None
+        if prefilter is None:
+            prefilter = prefilter_enabled()
+        if prefilter and any(dialog.id not in indexed_chats for dialog in target_dialogs):
+            try:
+                keyword_chats = await chats_with_hits(client, keywords)
+            except Exception:
+                keyword_chats = None
+
+        # history: a single pass that matches every keyword; search: one pass per keyword
+        if mode == 'history':
+            passes = [(", ".join(keywords), KeywordMatcher(keywords), keywords)]
+        else:
+            passes = [(keyword, None, [keyword]) for keyword in keywords]
+
+        def checkpoint_for(dialog, pass_key):
+            if checkpoints is None:
+                return None
+            checkpoint = saved.get((pass_key, dialog.id))
+            if checkpoint is None:
+                checkpoint = saved[(pass_key, dialog.id)] = ChatCheckpoint(checkpoints, job, pass_key, dialog.id)
+            return checkpoint
+
+        async def process(dialog, pass_index, keyword, matcher, hits):
+            # Runs once a worker slot is free, so the counter reflects chats actually started
+            progress['scanned_chats'] += 1
+            try:
+                if progress_callback:
+                    await progress_callback(
+                        keyword=keyword,
+                        keyword_index=pass_index,
+                        total_keywords=len(passes),
+                        scanned_chats=progress['scanned_chats'],
+                        total_chats=progress['total_chats'],
+                        deleted_count=stats['deleted_count']
+                    )
+
+                pass_key = '' if matcher is not None else normalize_text(keyword)
+                checkpoint = checkpoint_for(dialog, pass_key)
+                if dialog.id in indexed_chats:
+                    await delete_indexed(
+                        client, dialog, stats, hits.get(dialog.id, []), index,
+                        matcher or KeywordMatcher([keyword]), checkpoint=checkpoint
+                    )
+                else:
+                    await scan_dialog(client, dialog, stats, keyword=keyword, matcher=matcher, checkpoint=checkpoint)
+            except Exception as e:
+                failed_chats.append(f"[{keyword}] {dialog_name(dialog)}: {e}")
+
+        for pass_index, (keyword, matcher, pass_keywords) in enumerate(passes, start=1):
+            hits = await asyncio.to_thread(index.find, matcher or KeywordMatcher([keyword])) if indexed_chats else {}
+            candidates = None
+            if keyword_chats is not None:
+                candidates = set().union(*(keyword_chats[k] for k in pass_keywords))
+
+            # Only chats that can have a match: index hits, or prefilter hits where not indexed
+            pass_dialogs = [
+                dialog for dialog in target_dialogs
+                if (dialog.id in hits if dialog.id in indexed_chats else candidates is None or dialog.id in candidates)
+            ]
+            progress['scanned_chats'] = 0
+            progress['total_chats'] = len(pass_dialogs)
+            await asyncio.gather(*(
+                workers.run(process(dialog, pass_index, keyword, matcher, hits))
+                for dialog in pass_dialogs
+            ))
+    except Exception:
+        # A job that failed is left for the user to run again; only jobs cut
+        # short by a restart (still 'running') are resumed automatically
+        if checkpoints is not None:
+            checkpoints.finish(job, complete=False)
+        raise
+
+    if checkpoints is not None:
+        checkpoints.finish(job, complete=not failed_chats)
+
+    return {
+        'deleted_count': stats['deleted_count'],
+        'matched_count': stats['matched_count'],
+        'scanned_chats': progress['scanned_chats'],
+        'failed_chats': failed_chats,
+        'resumed': resumed,
+    }
@@ -0,0 +1,144 @@
+"""
+On-disk cache of resolved recipients (recipient -> InputPeer).
+Lets repeated sends skip get_entity()/ResolveUsername calls entirely.
+Entries expire after ENTITY_CACHE_TTL hours and are dropped when Telegram
+reports the peer as invalid or private.
+"""
+import os
+import threading
+import time
+
+from telethon import errors
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerSelf, InputPeerUser
+
+import state_db
+
+DEFAULT_TTL_HOURS = 168
+
+# Errors meaning the cached peer (or its access hash) is no longer usable
+INVALIDATING_ERRORS = (
+    errors.PeerIdInvalidError,
+    errors.ChannelPrivateError,
+    errors.ChannelInvalidError,
+    errors.ChatIdInvalidError,
+    errors.UserIdInvalidError,
+    errors.UsernameInvalidError,
+    errors.UsernameNotOccupiedError,
+)
+
+
+def cache_key(peer):
+    """Normalize a recipient peer (int ID or @username) into a cache key."""
+    if isinstance(peer, int):
+        return str(peer)
+    return str(peer).strip().lstrip('@').lower()
+
+
+def _to_row(input_peer):
+    if isinstance(input_peer, InputPeerUser):
+        return 'user', input_peer.user_id, input_peer.access_hash
+    if isinstance(input_peer, InputPeerChannel):
+        return 'channel', input_peer.channel_id, input_peer.access_hash
+    if isinstance(input_peer, InputPeerChat):
+        return 'chat', input_peer.chat_id, 0
+    if isinstance(input_peer, InputPeerSelf):
+        return 'self', 0, 0
+    return None
+
+
+def _from_row(peer_type, peer_id, access_hash):
+    if peer_type == 'user':
+        return InputPeerUser(peer_id, access_hash)
+    if peer_type == 'channel':
+        return InputPeerChannel(peer_id, access_hash)
+    if peer_type == 'chat':
+        return InputPeerChat(peer_id)
+    if peer_type == 'self':
+        return InputPeerSelf()
+    return None
+
+
+class EntityCache:
+    """Per-account cache (access hashes are only valid for the account that resolved them)."""
+
+    def __init__(self, account='session', ttl_hours=None, path=None):
+        self.account = account
+        if ttl_hours is None:
+            ttl_hours = float(os.getenv('ENTITY_CACHE_TTL', DEFAULT_TTL_HOURS))
+        self.ttl = ttl_hours * 3600
+        self.conn = state_db.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entity_cache (
+                account TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                peer_type TEXT NOT NULL,
+                peer_id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (account, recipient)
+            )
+        """)
+        self._memory = {}
+
+    def get(self, peer):
+        """Return the cached InputPeer for `peer`, or None if missing or expired."""
+        key = cache_key(peer)
+        cached = self._memory.get(key)
+        if cached is None:
+            row = self.conn.execute(
+                "SELECT peer_type, peer_id, access_hash, resolved_at FROM entity_cache "
+                "WHERE account = ? AND recipient = ?",
+                (self.account, key)
+            ).fetchone()
+            if row is None:
+                return None
+            cached = (_from_row(*row[:3]), row[3])
+            self._memory[key] = cached
+
+        input_peer, resolved_at = cached
+        if time.time() - resolved_at > self.ttl:
+            self.invalidate(peer)
+            return None
+        return input_peer
+
+    def put(self, peer, input_peer):
+        row = _to_row(input_peer)
+        if row is None:
+            return
+        key = cache_key(peer)
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entity_cache "
+            "(account, recipient, peer_type, peer_id, access_hash, resolved_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.account, key, *row, now)
+        )
+        self._memory[key] = (input_peer, now)
+
+    def invalidate(self, peer):
+        key = cache_key(peer)
+        self._memory.pop(key, None)
+        self.conn.execute(
+            "DELETE FROM entity_cache WHERE account = ? AND recipient = ?",
+            (self.account, key)
+        )
+
+    async def resolve(self, client, peer):
+        """Return an InputPeer for `peer`, calling Telegram only on a cache miss."""
+        input_peer = self.get(peer)
+        if input_peer is None:
+            input_peer = await client.get_input_entity(peer)
+            self.put(peer, input_peer)
+        return input_peer
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_entity_cache(account='session'):
+    """Return the process-wide cache for `account`."""
+    with _caches_lock:
+        cache = _caches.get(account)
+        if cache is None:
+            cache = _caches[account] = EntityCache(account)
+        return cache
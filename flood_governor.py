@@ -0,0 +1,179 @@
+"""
+Flood-wait governor shared by everything that talks to Telegram.
+Every request of a governed client first waits for its method budget and,
+for writes, for a per-chat budget. A FloodWait for a send, forward or
+delete pauses that chat only; any other FloodWait blocks the method for
+the whole account, so the scheduler, Send Now, Find ID and cleanup all
+slow down together instead of tripping over each other. Waits up to
+GOVERNOR_MAX_WAIT seconds are slept through and the request is repeated,
+at most GOVERNOR_MAX_RETRIES times; anything else is raised to the caller.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from telethon import TelegramClient, errors, utils
+
+from rate_limit import TokenBucket
+
+DEFAULT_MAX_WAIT = 60
+DEFAULT_MAX_RETRIES = 3
+
+# Requests per second and burst for methods Telegram limits tightly
+METHOD_BUDGETS = {
+    'contacts.ResolveUsernameRequest': (0.2, 5),
+    'messages.GetDialogsRequest': (1, 3),
+    'messages.GetHistoryRequest': (3, 10),
+    'messages.SearchRequest': (3, 10),
+    'messages.SearchGlobalRequest': (0.5, 3),
+    'messages.DeleteMessagesRequest': (2, 5),
+    'channels.DeleteMessagesRequest': (2, 5),
+    'messages.EditMessageRequest': (1, 3),
+}
+
+# Methods that write to a chat; each chat gets its own budget for these
+WRITE_METHODS = {
+    'messages.SendMessageRequest',
+    'messages.SendMediaRequest',
+    'messages.SendMultiMediaRequest',
+    'messages.ForwardMessagesRequest',
+    'messages.EditMessageRequest',
+    'messages.DeleteMessagesRequest',
+    'channels.DeleteMessagesRequest',
+}
+# Methods whose FloodWait only concerns the chat they were sent to
+PEER_FLOOD_METHODS = {
+    'messages.SendMessageRequest',
+    'messages.SendMediaRequest',
+    'messages.SendMultiMediaRequest',
+    'messages.ForwardMessagesRequest',
+    'messages.DeleteMessagesRequest',
+    'channels.DeleteMessagesRequest',
+}
+PEER_WRITE_RATE = 1
+PEER_WRITE_BURST = 5
+
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_IDLE_PEERS = 10000
+
+
+def method_name(request):
+    """'messages.SendMessageRequest'-style name of a request."""
+    return f"{type(request).__module__.rsplit('.', 1)[-1]}.{type(request).__name__}"
+
+
+def _peer_key(request):
+    for attr in ('peer', 'to_peer', 'channel'):
+        peer = getattr(request, attr, None)
+        if peer is None:
+            continue
+        if isinstance(peer, (int, str)):
+            return str(peer)
+        try:
+            return str(utils.get_peer_id(peer))
+        except Exception:
+            return None
+    return None
+
+
+class FloodGovernor:
+    def __init__(self, max_wait=None, max_retries=None):
+        self.max_wait = float(max_wait if max_wait is not None else os.getenv('GOVERNOR_MAX_WAIT', DEFAULT_MAX_WAIT))
+        self.max_retries = int(
+            max_retries if max_retries is not None else os.getenv('GOVERNOR_MAX_RETRIES', DEFAULT_MAX_RETRIES)
+        )
+        self._methods = {name: TokenBucket(rate, burst) for name, (rate, burst) in METHOD_BUDGETS.items()}
+        self._peers = {}
+        self._method_until = {}
+        self._peer_until = {}
+
+    def _peer_bucket(self, key):
+        bucket = self._peers.get(key)
+        if bucket is None:
+            if len(self._peers) > MAX_IDLE_PEERS:
+                self._peers = {k: b for k, b in self._peers.items() if not b.idle}
+            bucket = self._peers[key] = TokenBucket(PEER_WRITE_RATE, PEER_WRITE_BURST)
+        return bucket
+
+    def backoff_remaining(self, method=None, peer=None):
+        """
+        Seconds until Telegram allows `method` (and `peer`) again after a flood
+        wait; without arguments, the longest backoff currently in effect.
+        """
+        now = time.monotonic()
+        if method is None and peer is None:
+            until = max([*self._method_until.values(), *self._peer_until.values()], default=0)
+        else:
+            until = max(self._method_until.get(method, 0), self._peer_until.get(peer, 0))
+        return max(0.0, until - now)
+
+    async def acquire(self, request):
+        """Wait until `request` may be sent."""
+        method = method_name(request)
+        peer = _peer_key(request) if method in WRITE_METHODS else None
+
+        delay = self.backoff_remaining(method, peer)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.backoff_remaining(method, peer)
+
+        bucket = self._methods.get(method)
+        if bucket is not None:
+            await bucket.acquire()
+        if peer is not None:
+            await self._peer_bucket(peer).acquire()
+
+    def report(self, request, error):
+        """Record a FloodWait/SlowModeWait for `request`."""
+        until = time.monotonic() + error.seconds
+        method = method_name(request)
+        if method in PEER_FLOOD_METHODS or isinstance(error, errors.SlowModeWaitError):
+            # Only this one chat is limited; other chats keep their own lanes
+            peer = _peer_key(request)
+            if peer is not None:
+                self._peer_until[peer] = max(self._peer_until.get(peer, 0), until)
+                return
+        self._method_until[method] = max(self._method_until.get(method, 0), until)
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(account='session'):
+    """Return the process-wide governor of `account` (a session name)."""
+    with _governors_lock:
+        governor = _governors.get(account)
+        if governor is None:
+            governor = _governors[account] = FloodGovernor()
+        return governor
+
+
+class GovernedTelegramClient(TelegramClient):
+    """TelegramClient whose every request goes through a FloodGovernor."""
+
+    def __init__(self, session, *args, governor=None, **kwargs):
+        # Flood waits are handled by the governor instead of Telethon's own sleep
+        kwargs.setdefault('flood_sleep_threshold', 0)
+        super().__init__(session, *args, **kwargs)
+        self.governor = governor or get_governor(str(session))
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        requests = request if utils.is_list_like(request) else [request]
+        retries = 0
+        while True:
+            for r in requests:
+                await self.governor.acquire(r)
+            try:
+                return await super()._call(sender, request, ordered, flood_sleep_threshold)
+            except (errors.FloodWaitError, errors.SlowModeWaitError) as e:
+                self.governor.report(requests[0], e)
+                # Telethon blocks the whole constructor after a FloodWait; per-chat
+                # waits are tracked by the governor, so other chats stay open.
+                for r in requests:
+                    if method_name(r) in PEER_FLOOD_METHODS:
+                        self._flood_waited_requests.pop(r.CONSTRUCTOR_ID, None)
+                retries += 1
+                if e.seconds > self.governor.max_wait or retries > self.governor.max_retries:
+                    raise
@@ -0,0 +1,119 @@
+"""
+Image preprocessing for media added through the bot.
+Photos are downscaled to Telegram's effective photo resolution, stripped
+of metadata (EXIF, GPS, ...) and recompressed once, when they are added,
+so every later send uploads the small derived file instead of the
+original. Only media that arrived as photos is passed in; files sent as
+documents are kept as they are. The work runs in a process pool, never on
+the bot's event loop.
+Needs Pillow (installed with qrcode[pil]); without it files are kept as-is.
+"""
+import asyncio
+import importlib.util
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Telegram stores photos at up to 2560px on the longest side
+MAX_PHOTO_SIDE = 2560
+JPEG_QUALITY = 87
+
+# Formats handled; anything else (e.g. animations) is left untouched
+OPTIMIZABLE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+
+_pool = None
+
+
+def is_enabled():
+    if os.getenv('IMAGE_OPTIMIZE', 'true').strip().lower() in ('0', 'false', 'no', 'off'):
+        return False
+    return importlib.util.find_spec('PIL') is not None
+
+
+def derived_path(path):
+    """Path of the optimized copy of `path` (next to the original)."""
+    return f"{os.path.splitext(path)[0]}.opt.jpg"
+
+
+def _optimize_file(src, dst, max_side, quality):
+    """Runs in a worker process. Writes the optimized JPEG to `dst` and returns it."""
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as image:
+        # Apply the EXIF rotation before the metadata is dropped
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        tmp_path = f"{dst}.tmp"
+        try:
+            # Saving without exif=/icc_profile= drops all metadata
+            image.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+        except Exception:
+            # Don't leave a half-written file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, dst)
+    return dst
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        workers = int(os.getenv('IMAGE_WORKERS', min(2, os.cpu_count() or 1)))
+        # A spawned worker would re-run bot_manager's module-level setup, so fork
+        # where available; with fork all workers are started on the first submit.
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return _pool
+
+
+def start():
+    """
+    Start the worker processes early, before the bot creates any threads.
+    Blocks until they are forked, so call it before the event loop starts.
+    """
+    if is_enabled():
+        _get_pool().submit(os.getpid).result()
+
+
+async def optimize_image(path, max_side=MAX_PHOTO_SIDE, quality=JPEG_QUALITY):
+    """
+    Return the path of the optimized copy of `path`, creating it if needed.
+    The original is replaced by the derived file. Returns `path` unchanged
+    for non-photo files, when the pipeline is disabled or if processing fails.
+    """
+    if not path.lower().endswith(OPTIMIZABLE_EXTENSIONS) or not is_enabled():
+        return path
+
+    dst = derived_path(path)
+    if os.path.exists(dst):
+        return dst
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_get_pool(), _optimize_file, path, dst, max_side, quality)
+    except Exception as e:
+        print(f"⚠ Could not optimize {os.path.basename(path)}, keeping the original: {e}")
+        return path
+
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return dst
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,118 @@
+"""
+Durable fire ledger for scheduled posts.
+Records which (message, scheduled slot) pairs were claimed and completed,
+so a restart neither loses a due post nor sends it twice.
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import state_db
+
+STATUS_CLAIMED = 'claimed'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+# How long completed ledger rows are kept before being pruned
+LEDGER_RETENTION_DAYS = 30
+
+
+def get_grace_window():
+    """Missed slots older than this are not caught up after a restart."""
+    return timedelta(minutes=int(os.getenv('SCHEDULE_GRACE_MINUTES', 30)))
+
+
+SLOT_KEY_FORMAT = '%Y-%m-%dT%H:%MZ'
+
+
+def slot_key(fire_time):
+    return fire_time.astimezone(timezone.utc).strftime(SLOT_KEY_FORMAT)
+
+
+def _parse_moment(value):
+    if value.endswith('Z'):
+        # fromisoformat() only accepts the Z suffix from Python 3.11 on
+        return datetime.strptime(value, SLOT_KEY_FORMAT).replace(tzinfo=timezone.utc)
+    moment = datetime.fromisoformat(value)
+    # Rows written before schedules became timezone-aware hold local time
+    return moment if moment.tzinfo else moment.astimezone()
+
+
+class FireLedger:
+    def __init__(self, path=None):
+        self.conn = state_db.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fire_ledger (
+                msg_id TEXT NOT NULL,
+                slot TEXT NOT NULL,
+                status TEXT NOT NULL,
+                claimed_at REAL NOT NULL,
+                finished_at REAL,
+                error TEXT,
+                PRIMARY KEY (msg_id, slot)
+            );
+            CREATE INDEX IF NOT EXISTS fire_ledger_status ON fire_ledger (status, slot);
+            CREATE TABLE IF NOT EXISTS scheduler_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+    def claim(self, msg_id, fire_time):
+        """Claim a slot. Returns False if it was already claimed before."""
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO fire_ledger (msg_id, slot, status, claimed_at) VALUES (?, ?, ?, ?)",
+            (msg_id, slot_key(fire_time), STATUS_CLAIMED, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, msg_id, fire_time):
+        self._finish(msg_id, fire_time, STATUS_COMPLETED, None)
+
+    def fail(self, msg_id, fire_time, error):
+        self._finish(msg_id, fire_time, STATUS_FAILED, str(error))
+
+    def _finish(self, msg_id, fire_time, status, error):
+        self.conn.execute(
+            "UPDATE fire_ledger SET status = ?, finished_at = ?, error = ? WHERE msg_id = ? AND slot = ?",
+            (status, time.time(), error, msg_id, slot_key(fire_time))
+        )
+
+    def recover_interrupted(self, since):
+        """
+        Release slots that were claimed but never finished (the process died
+        mid-send) and return those still inside the grace window as
+        (msg_id, fire_time) pairs so they can be fired again.
+        """
+        rows = self.conn.execute(
+            "SELECT msg_id, slot FROM fire_ledger WHERE status = ?",
+            (STATUS_CLAIMED,)
+        ).fetchall()
+        self.conn.execute("DELETE FROM fire_ledger WHERE status = ?", (STATUS_CLAIMED,))
+
+        recovered = []
+        for msg_id, slot in rows:
+            fire_time = _parse_moment(slot)
+            if fire_time >= since:
+                recovered.append((msg_id, fire_time))
+        return recovered
+
+    def get_watermark(self):
+        """Moment up to which the scheduler has processed all deadlines."""
+        row = self.conn.execute(
+            "SELECT value FROM scheduler_state WHERE key = 'checked_until'"
+        ).fetchone()
+        return _parse_moment(row[0]) if row else None
+
+    def set_watermark(self, moment):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO scheduler_state (key, value) VALUES ('checked_until', ?)",
+            (moment.isoformat(),)
+        )
+
+    def prune(self):
+        cutoff = slot_key(datetime.now(timezone.utc) - timedelta(days=LEDGER_RETENTION_DAYS))
+        self.conn.execute(
+            "DELETE FROM fire_ledger WHERE status != ? AND slot < ?",
+            (STATUS_CLAIMED, cutoff)
+        )
@@ -0,0 +1,207 @@
+"""
+Media handling for deliveries.
+Each file is uploaded once and turned into a server-side photo/document
+reference, which is reused for every recipient. References are also kept
+on disk keyed by the file's SHA-256, so files sent every day are only
+uploaded again when Telegram reports the stored reference as expired.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+from telethon import errors, utils
+from telethon.tl.functions.messages import UploadMediaRequest
+from telethon.tl.types import (
+    InputDocument, InputMediaDocument, InputMediaPhoto, InputMediaUploadedDocument,
+    InputMediaUploadedPhoto, InputPeerSelf, InputPhoto
+)
+
+import state_db
+
+# Telegram rejects a stored reference with one of these; re-upload and retry
+FILE_REFERENCE_ERRORS = (
+    errors.FileReferenceExpiredError,
+    errors.FileReferenceInvalidError,
+)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _media_to_row(input_media):
+    if isinstance(input_media, InputMediaPhoto) and isinstance(input_media.id, InputPhoto):
+        ref = input_media.id
+        return 'photo', ref.id, ref.access_hash, ref.file_reference
+    if isinstance(input_media, InputMediaDocument) and isinstance(input_media.id, InputDocument):
+        ref = input_media.id
+        return 'document', ref.id, ref.access_hash, ref.file_reference
+    return None
+
+
+def _media_from_row(kind, media_id, access_hash, file_reference):
+    if kind == 'photo':
+        return InputMediaPhoto(InputPhoto(media_id, access_hash, file_reference))
+    if kind == 'document':
+        return InputMediaDocument(InputDocument(media_id, access_hash, file_reference))
+    return None
+
+
+class MediaCache:
+    """SHA-256 -> photo/document reference of the last successful upload, per account."""
+
+    def __init__(self, account='session', path=None):
+        self.account = account
+        self.conn = state_db.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS media_cache (
+                account TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                media_id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                file_reference BLOB NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (account, sha256)
+            )
+        """)
+
+    def get(self, sha256):
+        row = self.conn.execute(
+            "SELECT kind, media_id, access_hash, file_reference FROM media_cache "
+            "WHERE account = ? AND sha256 = ?",
+            (self.account, sha256)
+        ).fetchone()
+        return _media_from_row(*row) if row else None
+
+    def put(self, sha256, input_media):
+        row = _media_to_row(input_media)
+        if row is None:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO media_cache "
+            "(account, sha256, kind, media_id, access_hash, file_reference, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.account, sha256, *row, time.time())
+        )
+
+    def invalidate(self, sha256):
+        self.conn.execute(
+            "DELETE FROM media_cache WHERE account = ? AND sha256 = ?",
+            (self.account, sha256)
+        )
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_media_cache(account='session'):
+    with _caches_lock:
+        cache = _caches.get(account)
+        if cache is None:
+            cache = _caches[account] = MediaCache(account)
+        return cache
+
+
+# (path, mtime_ns, size) -> sha256, so unchanged files are hashed only once
+_file_hashes = {}
+
+
+async def get_file_hash(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    sha256 = _file_hashes.get(key)
+    if sha256 is None:
+        sha256 = await asyncio.to_thread(file_sha256, path)
+        _file_hashes[key] = sha256
+    return sha256
+
+
+class MediaUploader:
+    """
+    Prepares the media of one delivery run. `items` holds the reusable
+    media handles (in order); `refresh()` re-uploads them after Telegram
+    rejected a stored file reference.
+    """
+
+    def __init__(self, client, log_func=print, account='session'):
+        self.client = client
+        self.log = log_func
+        self.cache = get_media_cache(account)
+        self.items = []
+        self.generation = 0
+        self._files = []
+        self._refresh_lock = asyncio.Lock()
+
+    async def _upload(self, path):
+        input_file = await self.client.upload_file(path)
+        if utils.is_image(path):
+            uploaded = InputMediaUploadedPhoto(file=input_file)
+        else:
+            attributes, mime_type = utils.get_attributes(path)
+            uploaded = InputMediaUploadedDocument(
+                file=input_file,
+                mime_type=mime_type,
+                attributes=attributes,
+                force_file=False
+            )
+        # Attach the upload to a (not sent) message in Saved Messages to get
+        # a photo/document handle that any chat can reference.
+        message_media = await self.client(UploadMediaRequest(peer=InputPeerSelf(), media=uploaded))
+        return utils.get_input_media(message_media)
+
+    async def _get_media(self, path, sha256, use_cache=True):
+        if use_cache:
+            cached = self.cache.get(sha256)
+            if cached is not None:
+                return cached
+        try:
+            media = await self._upload(path)
+        except Exception as e:
+            self.log(f"⚠ Could not pre-upload {os.path.basename(path)}, sending file directly: {e}")
+            return path
+        self.cache.put(sha256, media)
+        return media
+
+    async def prepare(self, image_paths):
+        """
+        Fill `items` with media handles for the existing files in `image_paths`.
+        Missing files are skipped with a warning; if an upload fails the path
+        itself is used, so the send falls back to a plain upload.
+        """
+        self._files = []
+        self.items = []
+        for path in image_paths:
+            if not os.path.exists(path):
+                self.log(f"⚠ Warning: Image file not found: {path}")
+                continue
+            sha256 = await get_file_hash(path)
+            self._files.append((path, sha256))
+            self.items.append(await self._get_media(path, sha256))
+        return self.items
+
+    async def refresh(self, generation):
+        """
+        Re-upload every file after a file reference was rejected. Concurrent
+        callers that saw the same `generation` share a single re-upload.
+        """
+        async with self._refresh_lock:
+            if generation != self.generation:
+                return self.items
+            self.log("♻️ Media file reference expired, uploading again...")
+            items = []
+            for path, sha256 in self._files:
+                self.cache.invalidate(sha256)
+                items.append(await self._get_media(path, sha256, use_cache=False))
+            self.items = items
+            self.generation += 1
+            return self.items
@@ -0,0 +1,308 @@
+"""
+Optional local full-text index (SQLite FTS5) of the user account's messages.
+A one-time backfill walks every chat once; after that, new and edited
+messages are added by event handlers on the user client, and each start
+replays the updates missed while offline, fetches messages that are not
+indexed yet and re-reads the most recent ones for edits. Delete by Word
+uses the index only once that has finished, and checks every hit against
+the message's current text before deleting it.
+Enabled with MESSAGE_INDEX=true; needs an SQLite build with FTS5.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+from urllib.request import pathname2url
+
+from telethon import events
+from telethon.tl.types import Chat
+
+import state_db
+from cleanup import can_delete_for_everyone, can_delete_incoming, is_supported_cleanup_dialog, normalize_text
+
+# Rows written per transaction during the backfill
+BACKFILL_BATCH = 500
+
+# Already indexed messages re-read per chat on each start, for edits made while offline
+RECHECK_RECENT = 100
+
+# Channel IDs start at -100...; messages everywhere else share one ID sequence per account
+CHANNEL_ID_OFFSET = -1000000000000
+
+
+def fts5_available():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def is_enabled():
+    if os.getenv('MESSAGE_INDEX', 'false').strip().lower() not in ('1', 'true', 'yes', 'on'):
+        return False
+    return fts5_available()
+
+
+def get_index_db_path():
+    return os.getenv('MESSAGE_INDEX_DB', 'message_index.db')
+
+
+def fts_query(keywords):
+    """
+    FTS5 query for candidate rows of `keywords` (phrase, last word as prefix),
+    or None if a keyword has no searchable characters.
+    """
+    phrases = []
+    for keyword in keywords:
+        normalized = normalize_text(keyword)
+        if not re.search(r'[^\W_]', normalized):
+            return None
+        phrases.append('"' + normalized.replace('"', '""') + '"*')
+    return ' OR '.join(phrases)
+
+
+class MessageIndex:
+    def __init__(self, path=None):
+        self._attached = set()
+        self._sync_lock = asyncio.Lock()
+        # Chat ID -> whether incoming messages are indexed there (as in the backfill)
+        self._incoming = {}
+        # Chats whose last catch-up failed; their index may be behind
+        self._stale = set()
+        # Set once a sync has brought the index up to date
+        self.synced = False
+        self.path = path or get_index_db_path()
+        self.conn = state_db.connect(self.path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS indexed_messages (
+                id INTEGER PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                msg_id INTEGER NOT NULL,
+                out INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                UNIQUE (chat_id, msg_id)
+            )
+        """)
+        # External-content FTS table, kept in sync with indexed_messages by triggers
+        self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_fts
+            USING fts5(text, content='indexed_messages', content_rowid='id')
+        """)
+        self.conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS indexed_messages_ai AFTER INSERT ON indexed_messages BEGIN
+                INSERT INTO message_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS indexed_messages_ad AFTER DELETE ON indexed_messages BEGIN
+                INSERT INTO message_fts (message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS indexed_messages_au AFTER UPDATE OF text ON indexed_messages BEGIN
+                INSERT INTO message_fts (message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO message_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+        """)
+        # Per chat: the oldest message reached by the backfill, the newest one indexed
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS indexed_chats (
+                chat_id INTEGER PRIMARY KEY,
+                oldest_id INTEGER NOT NULL,
+                newest_id INTEGER NOT NULL,
+                done INTEGER NOT NULL
+            )
+        """)
+
+    # --- writing ---
+
+    def _upsert_rows(self, rows):
+        self.conn.executemany(
+            "INSERT INTO indexed_messages (chat_id, msg_id, out, text) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (chat_id, msg_id) DO UPDATE SET text = excluded.text",
+            rows
+        )
+
+    def add(self, chat_id, message):
+        """Index (or re-index after an edit) one message."""
+        if not message.message:
+            # Edited down to media only: nothing left to match
+            self.remove(chat_id, [message.id])
+            return
+        self._upsert_rows([(chat_id, message.id, int(bool(message.out)), normalize_text(message.message))])
+        self.conn.execute(
+            "UPDATE indexed_chats SET newest_id = MAX(newest_id, ?) WHERE chat_id = ?", (message.id, chat_id)
+        )
+
+    def remove(self, chat_id, message_ids):
+        self.conn.executemany(
+            "DELETE FROM indexed_messages WHERE chat_id = ? AND msg_id = ?",
+            [(chat_id, message_id) for message_id in message_ids]
+        )
+
+    def remove_unknown_chat(self, message_ids):
+        """Deletions reported without a chat; their IDs are unique outside channels."""
+        self.conn.executemany(
+            "DELETE FROM indexed_messages WHERE msg_id = ? AND chat_id > ?",
+            [(message_id, CHANNEL_ID_OFFSET) for message_id in message_ids]
+        )
+
+    # --- reading ---
+
+    def indexed_chats(self):
+        """
+        IDs of chats whose history is fully indexed and up to date. Empty until
+        a sync has caught up on what happened while the bot was offline.
+        """
+        if not self.synced:
+            return set()
+        done = {row[0] for row in self.conn.execute("SELECT chat_id FROM indexed_chats WHERE done = 1")}
+        return done - self._stale
+
+    def find(self, matcher):
+        """
+        Messages matching a cleanup.KeywordMatcher, as {chat_id: [(msg_id, out), ...]}.
+        FTS5 narrows the candidates; the matcher decides, so results are the same
+        as a history scan. Uses a read-only connection of its own, so it can run
+        in a worker thread while the event handlers keep writing.
+        """
+        query = fts_query(matcher.keywords)
+        conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro", uri=True)
+        try:
+            if query is None:
+                rows = conn.execute("SELECT chat_id, msg_id, out, text FROM indexed_messages")
+            else:
+                rows = conn.execute(
+                    "SELECT m.chat_id, m.msg_id, m.out, m.text FROM message_fts "
+                    "JOIN indexed_messages m ON m.id = message_fts.rowid WHERE message_fts MATCH ?",
+                    (query,)
+                )
+            hits = {}
+            for chat_id, msg_id, out, text in rows:
+                if matcher.matches(text):
+                    hits.setdefault(chat_id, []).append((msg_id, bool(out)))
+            return hits
+        finally:
+            conn.close()
+
+    # --- keeping it current ---
+
+    def attach(self, client):
+        """Register the handlers that index new, edited and deleted messages on `client` (once)."""
+        if id(client) in self._attached:
+            return
+        self._attached.add(id(client))
+        client.add_event_handler(self._on_message, events.NewMessage())
+        client.add_event_handler(self._on_message, events.MessageEdited())
+        client.add_event_handler(self._on_deleted, events.MessageDeleted())
+
+    async def _on_message(self, event):
+        if event.is_channel and not event.is_group:
+            return
+        if not event.out and not await self._indexes_incoming(event):
+            return
+        self.add(event.chat_id, event.message)
+
+    async def _indexes_incoming(self, event):
+        """Same rule as the backfill: incoming messages only where cleanup can delete them."""
+        incoming = self._incoming.get(event.chat_id)
+        if incoming is None:
+            chat = await event.get_chat()
+            incoming = self._incoming[event.chat_id] = (
+                event.is_private or isinstance(chat, Chat) or can_delete_for_everyone(chat)
+            )
+        return incoming
+
+    async def _on_deleted(self, event):
+        if event.chat_id is not None:
+            self.remove(event.chat_id, event.deleted_ids)
+        else:
+            self.remove_unknown_chat(event.deleted_ids)
+
+    async def sync(self, client, log_func=print):
+        """
+        Backfill chats that are not fully indexed yet (continuing where an
+        interrupted backfill stopped) and catch up on what happened while the bot
+        was down. Call after attach(), so the replayed updates reach the handlers.
+        """
+        async with self._sync_lock:
+            self.synced = False
+            await self._sync(client, log_func)
+            self.synced = True
+
+    async def _sync(self, client, log_func):
+        # Replays missed new, edited and deleted messages through the handlers,
+        # as far as Telegram still has them
+        await client.catch_up()
+        dialogs = [d for d in await client.get_dialogs(limit=None) if is_supported_cleanup_dialog(d)]
+        self._incoming.update((dialog.id, can_delete_incoming(dialog)) for dialog in dialogs)
+        state = {
+            row[0]: row[1:]
+            for row in self.conn.execute("SELECT chat_id, oldest_id, newest_id, done FROM indexed_chats")
+        }
+        backfilled = 0
+        for dialog in dialogs:
+            oldest_id, newest_id, done = state.get(dialog.id, (0, 0, 0))
+            try:
+                if done:
+                    await self._catch_up_chat(client, dialog, newest_id)
+                else:
+                    await self._backfill(client, dialog, oldest_id, newest_id)
+                    backfilled += 1
+                self._stale.discard(dialog.id)
+            except Exception as e:
+                self._stale.add(dialog.id)
+                log_func(f"⚠ Could not index {dialog.name}: {e}")
+        log_func(f"🗂 Message index up to date ({backfilled} chat(s) backfilled)")
+
+    def _messages(self, client, dialog, **kwargs):
+        # Only what cleanup could delete: everything where incoming messages can go, else our own
+        from_user = None if can_delete_incoming(dialog) else 'me'
+        return client.iter_messages(dialog.entity, from_user=from_user, limit=None, **kwargs)
+
+    async def _catch_up_chat(self, client, dialog, newest_id):
+        """Index messages newer than `newest_id` and re-read the RECHECK_RECENT ones before it."""
+        rows = []
+        emptied = []
+        top_id = newest_id
+        rechecked = 0
+        async for message in self._messages(client, dialog):
+            if message.id <= newest_id:
+                rechecked += 1
+                if rechecked > RECHECK_RECENT:
+                    break
+            top_id = max(top_id, message.id)
+            if message.message:
+                rows.append((dialog.id, message.id, int(bool(message.out)), normalize_text(message.message)))
+            else:
+                emptied.append(message.id)
+        self.conn.execute("BEGIN")
+        self._upsert_rows(rows)
+        self.remove(dialog.id, emptied)
+        self.conn.execute("UPDATE indexed_chats SET newest_id = MAX(newest_id, ?) WHERE chat_id = ?", (top_id, dialog.id))
+        self.conn.execute("COMMIT")
+
+    async def _backfill(self, client, dialog, oldest_id, newest_id):
+        if not oldest_id:
+            # Messages newer than the starting point arrive through the event handlers
+            newest_id = dialog.message.id if dialog.message else 0
+            oldest_id = newest_id + 1
+        self.conn.execute(
+            "INSERT OR IGNORE INTO indexed_chats (chat_id, oldest_id, newest_id, done) VALUES (?, ?, ?, 0)",
+            (dialog.id, oldest_id, newest_id)
+        )
+
+        rows = []
+        async for message in self._messages(client, dialog, offset_id=oldest_id):
+            if message.message:
+                rows.append((dialog.id, message.id, int(bool(message.out)), normalize_text(message.message)))
+            if len(rows) >= BACKFILL_BATCH:
+                self._save_backfill(dialog.id, rows, message.id)
+                rows = []
+            oldest_id = message.id
+        self._save_backfill(dialog.id, rows, oldest_id, done=True)
+
+    def _save_backfill(self, chat_id, rows, oldest_id, done=False):
+        self.conn.execute("BEGIN")
+        self._upsert_rows(rows)
+        self.conn.execute(
+            "UPDATE indexed_chats SET oldest_id = ?, done = ? WHERE chat_id = ?", (oldest_id, int(done), chat_id)
+        )
+        self.conn.execute("COMMIT")
@@ -0,0 +1,101 @@
+"""
+In-memory message model shared by the bot manager, the scheduler and TelegramSender.
+Raw config dicts are parsed and validated once at load time; hot paths work
+with these objects and never re-split recipient or schedule strings.
+"""
+from scheduler import compile_schedule
+
+
+def split_list(value):
+    """Accept a list or a comma-separated string and return stripped, non-empty items."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+class Recipient:
+    """
+    A parsed recipient:
+    - numeric ID (user, group or channel): peer is an int
+    - username (@channel, @user): peer is the original string
+    - forum topic "group_id:topic_id": peer is the group int, topic_id is set
+    """
+    __slots__ = ('raw', 'peer', 'topic_id')
+
+    def __init__(self, raw, peer, topic_id=None):
+        self.raw = raw
+        self.peer = peer
+        self.topic_id = topic_id
+
+    @classmethod
+    def parse(cls, raw):
+        raw = str(raw).strip()
+        if not raw:
+            return None
+
+        # Topic format: group_id:topic_id (e.g. -1001234567890:123)
+        if ':' in raw and not raw.startswith('@'):
+            group_id_str, topic_id_str = raw.split(':', 1)
+            try:
+                return cls(raw, int(group_id_str), int(topic_id_str))
+            except ValueError:
+                # Not a valid topic pair, treat as a regular recipient
+                pass
+
+        try:
+            return cls(raw, int(raw))
+        except ValueError:
+            return cls(raw, raw)
+
+    def __repr__(self):
+        return f"Recipient({self.raw!r})"
+
+
+class Message:
+    __slots__ = ('msg_id', 'text', 'recipients', 'image_paths', 'schedule', 'compiled_schedule', 'extra')
+
+    def __init__(self, msg_id, text='', recipients=(), image_paths=(), schedule=None, extra=None):
+        self.msg_id = msg_id
+        self.text = text or ''
+        self.recipients = tuple(recipients)
+        self.image_paths = tuple(image_paths)
+        self.schedule = schedule or None
+        self.compiled_schedule = compile_schedule(self.schedule)
+        self.extra = extra or {}
+
+    @classmethod
+    def from_dict(cls, msg_id, data):
+        """Build a message from a messages.yaml entry (also accepts the legacy 'message' key)."""
+        recipients = [Recipient.parse(r) for r in split_list(data.get('recipients'))]
+        extra = {
+            key: value for key, value in data.items()
+            if key not in ('text', 'message', 'recipients', 'image_paths', 'schedule')
+        }
+        return cls(
+            msg_id,
+            text=data.get('text') or data.get('message') or '',
+            recipients=[r for r in recipients if r is not None],
+            image_paths=split_list(data.get('image_paths')),
+            schedule=data.get('schedule'),
+            extra=extra
+        )
+
+    @property
+    def delivery(self):
+        """'send' (default) or 'forward' (post once to Saved Messages, then forward)."""
+        return str(self.extra.get('delivery') or 'send').strip().lower()
+
+    @property
+    def hide_sender(self):
+        """For forward delivery: drop the "Forwarded from" header."""
+        return bool(self.extra.get('hide_sender', False))
+
+    def __repr__(self):
+        return f"Message({self.msg_id!r}, recipients={len(self.recipients)}, images={len(self.image_paths)})"
+
+
+def build_messages(messages):
+    """Turn a {msg_id: data} mapping into {msg_id: Message}."""
+    return {msg_id: Message.from_dict(msg_id, data or {}) for msg_id, data in messages.items()}
@@ -0,0 +1,150 @@
+"""
+Durable delivery outbox.
+Every delivery is split into (message, recipient, slot) items. The
+(msg_id, slot, recipient) key makes a delivery idempotent: a slot that is
+fired again only sends to recipients that have not received it yet.
+Failed items are retried with exponential backoff by a background worker
+and dead-lettered after OUTBOX_MAX_ATTEMPTS attempts.
+"""
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import state_db
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_DEAD = 'dead'
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE = 60      # seconds before the first retry, doubled on every attempt
+MAX_RETRY_DELAY = 3600
+
+# Items being sent are hidden from other workers for this long; if the
+# process dies mid-send they become due again afterwards.
+LEASE_SECONDS = 600
+
+# How long finished (sent or dead) items are kept
+OUTBOX_RETENTION_DAYS = 30
+
+
+def manual_slot():
+    """Slot key for an unscheduled (Send Now) delivery."""
+    return f"manual-{datetime.now(timezone.utc):%Y-%m-%dT%H:%M:%S.%fZ}"
+
+
+class DeliveryOutbox:
+    def __init__(self, path=None, max_attempts=None, retry_base=None):
+        self.max_attempts = int(max_attempts or os.getenv('OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+        self.retry_base = float(retry_base or os.getenv('OUTBOX_RETRY_BASE', DEFAULT_RETRY_BASE))
+        self.conn = state_db.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                msg_id TEXT NOT NULL,
+                slot TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (msg_id, slot, recipient)
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+        """)
+
+    def enqueue(self, msg_id, slot, recipients):
+        """Add items for a delivery. Items that already exist (in any state) are left as they are."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO outbox "
+            "(msg_id, slot, recipient, status, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(msg_id, slot, recipient, STATUS_PENDING, now, now, now) for recipient in recipients]
+        )
+
+    def claim(self, msg_id, slot):
+        """Lease and return the recipients of a delivery that are due to be (re)sent."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute(
+                "SELECT recipient FROM outbox "
+                "WHERE msg_id = ? AND slot = ? AND status = ? AND next_attempt_at <= ?",
+                (msg_id, slot, STATUS_PENDING, now)
+            ).fetchall()
+            recipients = [row[0] for row in rows]
+            self.conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE msg_id = ? AND slot = ? AND recipient = ?",
+                [(now + LEASE_SECONDS, msg_id, slot, recipient) for recipient in recipients]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return recipients
+
+    def mark_sent(self, msg_id, slot, recipient):
+        self.conn.execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = NULL, updated_at = ? "
+            "WHERE msg_id = ? AND slot = ? AND recipient = ?",
+            (STATUS_SENT, time.time(), msg_id, slot, recipient)
+        )
+
+    def mark_failed(self, msg_id, slot, recipient, error, retry_after=0, permanent=False):
+        """
+        Record a failed attempt and schedule the next one. Returns True if the
+        item was dead-lettered (permanent error or out of attempts).
+        """
+        row = self.conn.execute(
+            "SELECT attempts FROM outbox WHERE msg_id = ? AND slot = ? AND recipient = ?",
+            (msg_id, slot, recipient)
+        ).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        dead = permanent or attempts >= self.max_attempts
+
+        now = time.time()
+        delay = min(MAX_RETRY_DELAY, self.retry_base * 2 ** (attempts - 1))
+        # Jitter keeps retries of many recipients from hitting Telegram at the same moment
+        delay = max(delay * random.uniform(0.8, 1.2), retry_after)
+        self.conn.execute(
+            "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+            "WHERE msg_id = ? AND slot = ? AND recipient = ?",
+            (STATUS_DEAD if dead else STATUS_PENDING, attempts, now + delay, str(error), now,
+             msg_id, slot, recipient)
+        )
+        return dead
+
+    def drop(self, msg_id, slot, error):
+        """Dead-letter every pending item of a delivery (e.g. the message was removed)."""
+        self.conn.execute(
+            "UPDATE outbox SET status = ?, last_error = ?, updated_at = ? "
+            "WHERE msg_id = ? AND slot = ? AND status = ?",
+            (STATUS_DEAD, str(error), time.time(), msg_id, slot, STATUS_PENDING)
+        )
+
+    def due_deliveries(self):
+        """(msg_id, slot) pairs that have at least one item due for a retry."""
+        return self.conn.execute(
+            "SELECT DISTINCT msg_id, slot FROM outbox WHERE status = ? AND next_attempt_at <= ?",
+            (STATUS_PENDING, time.time())
+        ).fetchall()
+
+    def next_attempt_in(self):
+        """Seconds until the next pending item is due (None if nothing is pending)."""
+        row = self.conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?",
+            (STATUS_PENDING,)
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def prune(self):
+        cutoff = time.time() - OUTBOX_RETENTION_DAYS * 86400
+        self.conn.execute(
+            "DELETE FROM outbox WHERE status != ? AND updated_at < ?",
+            (STATUS_PENDING, cutoff)
+        )
@@ -0,0 +1,102 @@
+"""
+Token-bucket rate limiting for Telegram sends.
+One bucket caps the whole account, and one bucket per chat ("lane") caps
+each recipient. A FloodWait pauses only the lane it was reported for.
+`send_slots` caps how many sends of the account are in flight at once,
+across every sender in the process.
+"""
+import asyncio
+import os
+import threading
+import time
+
+DEFAULT_ACCOUNT_RATE = 5           # sends per second for the whole account
+DEFAULT_CHAT_RATE_PER_MINUTE = 20  # sends per minute to a single chat
+DEFAULT_CHAT_BURST = 3
+DEFAULT_SEND_CONCURRENCY = 5       # sends in flight at once for the whole account
+
+# Idle lane buckets are dropped once there are more than this many
+MAX_IDLE_LANES = 10000
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def pause(self, seconds):
+        """Block the bucket for `seconds` (e.g. after a FloodWait), then allow a single send."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 1.0
+        self.updated = self.paused_until
+
+    @property
+    def idle(self):
+        now = time.monotonic()
+        self._refill(now)
+        return now >= self.paused_until and self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SendRateLimiter:
+    def __init__(self, account_rate=None, chat_rate_per_minute=None, chat_burst=DEFAULT_CHAT_BURST, concurrency=None):
+        account_rate = float(account_rate or os.getenv('SEND_RATE', DEFAULT_ACCOUNT_RATE))
+        chat_rate_per_minute = float(
+            chat_rate_per_minute or os.getenv('SEND_CHAT_RATE_PER_MINUTE', DEFAULT_CHAT_RATE_PER_MINUTE)
+        )
+        self.account = TokenBucket(account_rate, max(1.0, account_rate))
+        self.chat_rate = chat_rate_per_minute / 60
+        self.chat_burst = chat_burst
+        self.send_slots = asyncio.Semaphore(int(concurrency or os.getenv('SEND_CONCURRENCY', DEFAULT_SEND_CONCURRENCY)))
+        self._lanes = {}
+
+    def lane(self, key):
+        bucket = self._lanes.get(key)
+        if bucket is None:
+            if len(self._lanes) > MAX_IDLE_LANES:
+                self._lanes = {k: b for k, b in self._lanes.items() if not b.idle}
+            bucket = self._lanes[key] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, key):
+        """Wait until both the chat lane `key` and the account allow one more send."""
+        await self.lane(key).acquire()
+        await self.account.acquire()
+
+    def flood_wait(self, key, seconds):
+        """Pause only the lane `key` for `seconds`."""
+        self.lane(key).pause(seconds)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(account='session'):
+    """Return the process-wide limiter for `account`, shared by all senders."""
+    with _limiters_lock:
+        limiter = _limiters.get(account)
+        if limiter is None:
+            limiter = _limiters[account] = SendRateLimiter()
+        return limiter
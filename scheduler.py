@@ -0,0 +1,472 @@
+"""
+Next-fire-time scheduler for timed posts.
+Every scheduled message is compiled once into an object that can compute
+its next occurrence. Upcoming fire times are kept in a heap, so the
+scheduler sleeps until the earliest deadline instead of polling.
+
+Supported schedules (messages.yaml):
+    {type: daily, time: "09:00"}
+    {type: weekly, time: "09:00", days: [Monday, Friday]}
+    {type: cron, cron: "0 9 * * 1-5"}
+Any of them may carry `timezone: Europe/Lisbon` (IANA name). Without it the
+TIMEZONE environment variable is used, and then the server's local time.
+All fire times handed out by the scheduler are timezone-aware UTC datetimes.
+"""
+import asyncio
+import bisect
+import heapq
+import itertools
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_JOB_TIMEOUT = 600
+
+# Minutes before a fire time at which recipients are resolved and media uploaded
+DEFAULT_PREWARM_MINUTES = 5
+
+# Upper bound for a single sleep, so edits made to messages.yaml outside
+# the bot are still picked up without an explicit notification.
+MAX_IDLE_SLEEP = 60
+
+# A cron expression that matches nothing within this many years is rejected
+CRON_SEARCH_YEARS = 5
+
+CRON_MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+MONTH_NAMES = {name: i for i, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+WEEKDAY_NAMES = {name: i for i, name in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])}
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def get_weekly_days(schedule):
+    """Backward compatible reader for weekly schedule days."""
+    if not schedule or schedule.get('type') != 'weekly':
+        return []
+
+    days = schedule.get('days')
+    if isinstance(days, list):
+        return [d for d in days if d in DAYS_OF_WEEK]
+
+    day = schedule.get('day')
+    if isinstance(day, str) and day in DAYS_OF_WEEK:
+        return [day]
+
+    return []
+
+
+def _parse_hh_mm(time_str):
+    try:
+        hour_str, minute_str = str(time_str).strip().split(':')
+        hour, minute = int(hour_str), int(minute_str)
+    except (ValueError, AttributeError):
+        return None
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return hour, minute
+
+
+def resolve_timezone(name=None):
+    """
+    Return a ZoneInfo for `name` (or the TIMEZONE env var). None means the
+    server's local time. Raises ValueError for unknown zone names.
+    """
+    name = name or os.getenv('TIMEZONE')
+    if not name:
+        return None
+    try:
+        return ZoneInfo(str(name).strip())
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown timezone: {name}") from e
+
+
+def _parse_cron_field(field, low, high, names=None):
+    values = set()
+    for part in field.lower().split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            if not step_str.isdigit() or int(step_str) == 0:
+                raise ValueError(f"Invalid step in cron field '{field}'")
+            step = int(step_str)
+
+        if part == '*':
+            start, end = low, high
+        else:
+            bounds = part.split('-', 1)
+            try:
+                numbers = [(names or {}).get(b) if b in (names or {}) else int(b) for b in bounds]
+            except ValueError:
+                raise ValueError(f"Invalid value in cron field '{field}'") from None
+            start = numbers[0]
+            # "a/n" means "from a to the end of the range, every n"
+            end = numbers[1] if len(numbers) == 2 else (high if step > 1 else start)
+
+        if not (low <= start <= high and low <= end <= high) or start > end:
+            raise ValueError(f"Value out of range in cron field '{field}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expr):
+    """
+    Parse a 5-field cron expression (minute hour day-of-month month day-of-week)
+    into a tuple of sorted value lists plus day-of-month/day-of-week flags.
+    Raises ValueError for malformed expressions.
+    """
+    expr = CRON_MACROS.get(str(expr).strip().lower(), str(expr))
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError("Cron expression must have 5 fields: minute hour day month weekday")
+
+    minutes = _parse_cron_field(fields[0], 0, 59)
+    hours = _parse_cron_field(fields[1], 0, 23)
+    month_days = _parse_cron_field(fields[2], 1, 31)
+    months = _parse_cron_field(fields[3], 1, 12, MONTH_NAMES)
+    weekdays = _parse_cron_field(fields[4], 0, 7, WEEKDAY_NAMES)
+    if 7 in weekdays:
+        weekdays.discard(7)
+        weekdays.add(0)
+
+    return (
+        sorted(minutes), sorted(hours), frozenset(month_days), sorted(months),
+        frozenset(weekdays), fields[2] != '*', fields[4] != '*'
+    )
+
+
+class WallClockSchedule:
+    """
+    Base class for schedules defined in local wall-clock time of a timezone.
+    Subclasses implement `_next_wall_after(wall)` on naive datetimes;
+    `next_after(moment)` handles timezone conversion and DST transitions.
+    """
+    __slots__ = ('tz',)
+
+    def __init__(self, tz=None):
+        self.tz = tz
+
+    def _to_wall(self, moment):
+        local = moment.astimezone(self.tz) if self.tz else moment.astimezone()
+        return local.replace(tzinfo=None)
+
+    def _from_wall(self, wall):
+        # Naive astimezone() interprets the value as server local time
+        aware = wall.replace(tzinfo=self.tz) if self.tz else wall.astimezone()
+        return aware.astimezone(timezone.utc)
+
+    def next_after(self, moment):
+        """Return the first fire time (aware, UTC) strictly after `moment`."""
+        wall = self._to_wall(moment)
+        # A wall time can map to an instant before `moment` when clocks are
+        # turned back, so keep looking until the instant is in the future.
+        for _ in range(4):
+            wall = self._next_wall_after(wall)
+            if wall is None:
+                return None
+            candidate = self._from_wall(wall)
+            if candidate > moment:
+                return candidate
+        return None
+
+    def _next_wall_after(self, wall):
+        raise NotImplementedError
+
+
+class DailySchedule(WallClockSchedule):
+    __slots__ = ('hour', 'minute')
+
+    def __init__(self, hour, minute, tz=None):
+        super().__init__(tz)
+        self.hour = hour
+        self.minute = minute
+
+    def _next_wall_after(self, wall):
+        candidate = wall.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if candidate <= wall:
+            candidate += timedelta(days=1)
+        return candidate
+
+
+class WeeklySchedule(WallClockSchedule):
+    __slots__ = ('hour', 'minute', 'weekdays')
+
+    def __init__(self, hour, minute, weekdays, tz=None):
+        super().__init__(tz)
+        self.hour = hour
+        self.minute = minute
+        self.weekdays = frozenset(weekdays)
+
+    def _next_wall_after(self, wall):
+        candidate = wall.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if candidate <= wall:
+            candidate += timedelta(days=1)
+        for _ in range(7):
+            if candidate.weekday() in self.weekdays:
+                return candidate
+            candidate += timedelta(days=1)
+        return None
+
+
+class CronSchedule(WallClockSchedule):
+    """Precompiled cron expression; the next occurrence is found field by field."""
+    __slots__ = ('minutes', 'hours', 'month_days', 'months', 'weekdays', 'dom_restricted', 'dow_restricted')
+
+    def __init__(self, expr, tz=None):
+        super().__init__(tz)
+        (self.minutes, self.hours, self.month_days, self.months, self.weekdays,
+         self.dom_restricted, self.dow_restricted) = parse_cron(expr)
+
+    def _day_matches(self, day):
+        dom_ok = day.day in self.month_days
+        # Python: Monday=0; cron: Sunday=0
+        dow_ok = (day.weekday() + 1) % 7 in self.weekdays
+        if self.dom_restricted and self.dow_restricted:
+            return dom_ok or dow_ok
+        return dom_ok and dow_ok
+
+    def _next_wall_after(self, wall):
+        t = wall.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit_year = t.year + CRON_SEARCH_YEARS
+        while t.year <= limit_year:
+            if t.month not in self.months:
+                i = bisect.bisect_right(self.months, t.month)
+                if i < len(self.months):
+                    t = datetime(t.year, self.months[i], 1)
+                else:
+                    t = datetime(t.year + 1, self.months[0], 1)
+                continue
+
+            if not self._day_matches(t):
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+
+            if t.hour not in self.hours:
+                i = bisect.bisect_right(self.hours, t.hour)
+                if i < len(self.hours):
+                    t = t.replace(hour=self.hours[i], minute=0)
+                else:
+                    t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+
+            i = bisect.bisect_left(self.minutes, t.minute)
+            if i < len(self.minutes):
+                return t.replace(minute=self.minutes[i])
+            t = t.replace(minute=0) + timedelta(hours=1)
+        return None
+
+
+def compile_schedule(schedule):
+    """
+    Compile a schedule dict from messages.yaml into an object with a
+    `next_after(moment)` method. Returns None for manual or invalid schedules.
+    """
+    try:
+        return compile_schedule_strict(schedule)
+    except ValueError:
+        return None
+
+
+def compile_schedule_strict(schedule):
+    """Like compile_schedule(), but raises ValueError for invalid schedules."""
+    if not schedule:
+        return None
+
+    tz = resolve_timezone(schedule.get('timezone'))
+    schedule_type = schedule.get('type')
+
+    if schedule_type == 'cron':
+        return CronSchedule(schedule.get('cron', ''), tz)
+
+    parsed_time = _parse_hh_mm(schedule.get('time'))
+    if parsed_time is None:
+        raise ValueError(f"Invalid schedule time: {schedule.get('time')}")
+    hour, minute = parsed_time
+
+    if schedule_type == 'daily':
+        return DailySchedule(hour, minute, tz)
+
+    if schedule_type == 'weekly':
+        weekdays = [DAYS_OF_WEEK.index(d) for d in get_weekly_days(schedule)]
+        if not weekdays:
+            raise ValueError("Weekly schedule has no days selected")
+        return WeeklySchedule(hour, minute, weekdays, tz)
+
+    raise ValueError(f"Unknown schedule type: {schedule_type}")
+
+
+class Scheduler:
+    """
+    Heap of (fire_time, seq, msg_id, recurring) entries.
+
+    `load()` rebuilds the heap from the message config, `pop_due()` returns
+    everything whose deadline has passed and pushes the following occurrence,
+    and `wait()` sleeps until the earliest deadline or until `notify()` is
+    called. Each fired entry costs O(log n).
+
+    With a `prewarm_lead`, every upcoming occurrence also gets a pre-warm
+    deadline that much earlier, handed out once by `pop_prewarm()`.
+    """
+
+    def __init__(self, prewarm_lead=None):
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._checked_until = None
+        self.prewarm_lead = prewarm_lead or None
+        # (prewarm_at, seq, msg_id, fire_time) and the occurrences already handed out
+        self._prewarm_heap = []
+        self._prewarmed = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def checked_until(self):
+        """Moment up to which all deadlines have been popped."""
+        return self._checked_until
+
+    def resume_from(self, moment):
+        """Start the next `load()` from `moment` so missed slots after it are due."""
+        self._checked_until = moment
+
+    def load(self, messages, now=None):
+        """Rebuild the heap from a {msg_id: Message} mapping."""
+        now = now or utc_now()
+        # Deadlines between the last processed moment and now are kept,
+        # so a reload never drops a post that was just about to fire.
+        start = self._checked_until or now
+
+        self._heap = []
+        self._prewarm_heap = []
+        self._entries = {}
+        for msg_id, message in messages.items():
+            compiled = message.compiled_schedule
+            if compiled is None:
+                continue
+            fire_time = compiled.next_after(start)
+            if fire_time is None:
+                continue
+            self._entries[msg_id] = (compiled, message)
+            self._heap.append((fire_time, next(self._seq), msg_id, True))
+            if self.prewarm_lead:
+                self._prewarm_heap.append((fire_time - self.prewarm_lead, next(self._seq), msg_id, fire_time))
+        heapq.heapify(self._heap)
+        heapq.heapify(self._prewarm_heap)
+        self._prewarmed = {(m, t) for m, t in self._prewarmed if m in self._entries and t > start}
+        self._checked_until = start
+
+    def add_catch_up(self, msg_id, fire_time):
+        """Queue a one-off firing of an already loaded message for a past slot."""
+        if msg_id in self._entries:
+            heapq.heappush(self._heap, (fire_time, next(self._seq), msg_id, False))
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+    def _next_wakeup(self):
+        deadlines = [heap[0][0] for heap in (self._heap, self._prewarm_heap) if heap]
+        return min(deadlines) if deadlines else None
+
+    def pop_prewarm(self, now=None):
+        """
+        Pop every occurrence whose pre-warm time has passed as (msg_id, fire_time, message).
+        Each occurrence is returned once, and only while its fire time is still ahead.
+        """
+        now = now or utc_now()
+        due = []
+        while self._prewarm_heap and self._prewarm_heap[0][0] <= now:
+            _, _, msg_id, fire_time = heapq.heappop(self._prewarm_heap)
+            entry = self._entries.get(msg_id)
+            if entry is None or fire_time <= now or (msg_id, fire_time) in self._prewarmed:
+                continue
+            self._prewarmed.add((msg_id, fire_time))
+            due.append((msg_id, fire_time, entry[1]))
+        return due
+
+    def pop_due(self, now=None):
+        """Pop every entry due at or before `now` as (msg_id, fire_time, message)."""
+        now = now or utc_now()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_time, _, msg_id, recurring = heapq.heappop(self._heap)
+            entry = self._entries.get(msg_id)
+            if entry is None:
+                continue
+            compiled, message = entry
+            due.append((msg_id, fire_time, message))
+            if not recurring:
+                continue
+            self._prewarmed.discard((msg_id, fire_time))
+
+            next_time = compiled.next_after(max(fire_time, now))
+            if next_time is not None:
+                heapq.heappush(self._heap, (next_time, next(self._seq), msg_id, True))
+                if self.prewarm_lead:
+                    heapq.heappush(
+                        self._prewarm_heap,
+                        (next_time - self.prewarm_lead, next(self._seq), msg_id, next_time)
+                    )
+        self._checked_until = now
+        return due
+
+    def notify(self):
+        """Wake up `wait()` early, e.g. after the config was changed."""
+        self._wakeup.set()
+
+    async def wait(self, now=None):
+        """Sleep until the earliest deadline, MAX_IDLE_SLEEP or `notify()`."""
+        now = now or utc_now()
+        timeout = MAX_IDLE_SLEEP
+        deadline = self._next_wakeup()
+        if deadline is not None:
+            timeout = min(timeout, max((deadline - now).total_seconds(), 0))
+
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+
+class WorkerPool:
+    """
+    Bounded pool for background jobs.
+
+    `submit()` starts a tracked background task right away, `run()` waits
+    for one of `concurrency` worker slots and then awaits the coroutine
+    with a per-job `timeout` (waiting for a slot does not count against it),
+    which a single call may override.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_JOB_TIMEOUT):
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = float(timeout) if timeout else None
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._tasks = set()
+
+    def submit(self, coro):
+        """Schedule `coro` as a background task and return the task."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run(self, coro, timeout=None):
+        """Run `coro` in a worker slot. Raises asyncio.TimeoutError on timeout."""
+        async with self._slots:
+            return await asyncio.wait_for(coro, timeout=timeout or self.timeout)
@@ -0,0 +1,24 @@
+"""
+Shared SQLite database for the bot's runtime state.
+The fire ledger and other small tables that must survive restarts live here.
+WAL mode with synchronous=NORMAL keeps each write to a cheap append.
+"""
+import os
+import sqlite3
+
+
+def get_state_db_path():
+    return os.getenv('STATE_DB', 'bot_state.db')
+
+
+def connect(path=None):
+    """Open a connection to the state database in autocommit mode."""
+    conn = sqlite3.connect(
+        path or get_state_db_path(),
+        isolation_level=None,
+        check_same_thread=False,
+        timeout=30
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
@@ -0,0 +1,497 @@
+"""
+Storage for message configurations.
+
+Two backends share one interface and are selected with STORAGE_BACKEND:
+- yaml (default): messages.yaml plus a write-ahead journal, cached per
+  process and only re-read when either file's mtime or size changes.
+- sqlite: messages.db with indexed columns for schedules and recipients,
+  so single-message edits do not rewrite the whole config.
+
+Run `python storage.py migrate` to copy messages.yaml into the SQLite
+database (this also happens automatically the first time the SQLite
+backend starts with an empty database).
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+import state_db
+from models import Message, build_messages
+
+# Journal records folded into a new messages.yaml snapshot
+JOURNAL_COMPACT_EVERY = 50
+
+# Keys with dedicated columns in the SQLite backend; anything else is kept in `extra`
+SQLITE_MESSAGE_KEYS = ('text', 'image_paths', 'recipients', 'schedule')
+
+
+class ConfigStorage:
+    """
+    Common interface of the storage backends.
+
+    `load()` returns {'messages': {msg_id: data}}; the dict is cached and
+    shared, so treat it as read-only and change messages through
+    `put_message()`, `delete_message()` and `clear_messages()`.
+    `version` increases every time the returned config changes.
+    `load_messages()` returns the same config as parsed Message objects.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._config = None
+        self._models = None
+        self._models_version = None
+        self._lock = threading.RLock()
+
+    def load_messages(self):
+        """Return {msg_id: Message}, rebuilt only when the config changed."""
+        config = self.load()
+        with self._lock:
+            if self._models is None or self._models_version != self.version:
+                self._models = build_messages(config.get('messages', {}))
+                self._models_version = self.version
+            return self._models
+
+    def _changed(self, msg_id=None, data=None, cleared=False):
+        """Bump `version` after a local write, patching the parsed models in place."""
+        in_sync = self._models is not None and self._models_version == self.version
+        self.version += 1
+        if not in_sync:
+            return
+        if cleared:
+            self._models = {}
+        elif data is None:
+            self._models.pop(msg_id, None)
+        else:
+            self._models[msg_id] = Message.from_dict(msg_id, data)
+        self._models_version = self.version
+
+    def current_version(self):
+        """
+        `version` after picking up outside changes; only stats the files
+        (YAML) or reads PRAGMA data_version (SQLite) when nothing changed.
+        """
+        self.load()
+        return self.version
+
+    def load(self):
+        raise NotImplementedError
+
+    def put_message(self, msg_id, data):
+        raise NotImplementedError
+
+    def delete_message(self, msg_id):
+        raise NotImplementedError
+
+    def clear_messages(self):
+        raise NotImplementedError
+
+    def scheduled_messages(self):
+        """Return {msg_id: Message} for messages with a valid schedule."""
+        return {
+            msg_id: message for msg_id, message in self.load_messages().items()
+            if message.compiled_schedule is not None
+        }
+
+
+class YamlConfigStore(ConfigStorage):
+    """
+    messages.yaml snapshot plus an append-only journal (messages.yaml.journal).
+
+    Each change is one JSON line appended to the journal; `load()` replays the
+    journal on top of the snapshot. Once the journal grows past
+    JOURNAL_COMPACT_EVERY records it is folded into a new snapshot, written to
+    a temp file and renamed over messages.yaml, so a crash never leaves a
+    truncated config. Writers hold an exclusive lock on messages.yaml.lock.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.lock_path = path + '.lock'
+        self._signature = None
+        self._journal_records = 0
+
+    def _stat_signature(self):
+        signature = []
+        for path in (self.path, self.journal_path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+                continue
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    @contextmanager
+    def _writer_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_snapshot(self):
+        config = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = yaml.safe_load(f)
+        if not config or 'messages' not in config:
+            config = {'messages': {}}
+        if config['messages'] is None:
+            config['messages'] = {}
+        return config
+
+    def _replay_journal(self, config):
+        records = 0
+        if not os.path.exists(self.journal_path):
+            return records
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash mid-append
+                    continue
+                self._apply(config, record)
+                records += 1
+        return records
+
+    @staticmethod
+    def _apply(config, record):
+        op = record.get('op')
+        if op == 'put':
+            config['messages'][record['id']] = record['data']
+        elif op == 'delete':
+            config['messages'].pop(record['id'], None)
+        elif op == 'clear':
+            config['messages'] = {}
+
+    def load(self):
+        """Return the cached config, re-reading the files only if they changed."""
+        signature = self._stat_signature()
+        with self._lock:
+            if self._config is not None and signature == self._signature:
+                return self._config
+
+            config = self._read_snapshot()
+            self._journal_records = self._replay_journal(config)
+            self._config = config
+            self._signature = signature
+            self.version += 1
+            return config
+
+    def _write_snapshot(self, config):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.messages-', suffix='.yaml', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                yaml.dump(config, f, allow_unicode=True, sort_keys=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _fsync_directory(directory)
+
+        # Only drop the journal once the snapshot containing it is durable.
+        # Replaying an already-applied journal is harmless, as every record
+        # overwrites state instead of modifying it.
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_records = 0
+
+    def _append(self, record):
+        with self._writer_lock():
+            config = self.load()
+            line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+            with open(self.journal_path, 'ab+') as f:
+                # Terminate a torn line left by a crash so this record stays readable
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        line = b'\n' + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(config, record)
+            self._journal_records += 1
+
+            if self._journal_records >= JOURNAL_COMPACT_EVERY:
+                self._write_snapshot(config)
+            self._signature = self._stat_signature()
+            self._changed(record.get('id'), record.get('data'), cleared=record['op'] == 'clear')
+
+    def put_message(self, msg_id, data):
+        self._append({'op': 'put', 'id': msg_id, 'data': data})
+
+    def delete_message(self, msg_id):
+        self._append({'op': 'delete', 'id': msg_id})
+
+    def clear_messages(self):
+        self._append({'op': 'clear'})
+
+
+class SqliteConfigStore(ConfigStorage):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._data_version = None
+        self.conn = state_db.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                msg_id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL DEFAULT '',
+                image_paths TEXT NOT NULL DEFAULT '[]',
+                schedule TEXT,
+                schedule_type TEXT,
+                schedule_time TEXT,
+                timezone TEXT,
+                extra TEXT NOT NULL DEFAULT '{}',
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_position ON messages (position);
+            CREATE INDEX IF NOT EXISTS messages_schedule ON messages (schedule_type, schedule_time);
+            CREATE TABLE IF NOT EXISTS message_schedule_days (
+                msg_id TEXT NOT NULL REFERENCES messages (msg_id) ON DELETE CASCADE,
+                day TEXT NOT NULL,
+                PRIMARY KEY (msg_id, day)
+            );
+            CREATE INDEX IF NOT EXISTS message_schedule_days_day ON message_schedule_days (day);
+            CREATE TABLE IF NOT EXISTS message_recipients (
+                msg_id TEXT NOT NULL REFERENCES messages (msg_id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                recipient TEXT NOT NULL,
+                PRIMARY KEY (msg_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS message_recipients_recipient ON message_recipients (recipient);
+            CREATE TABLE IF NOT EXISTS storage_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self.conn.execute('PRAGMA foreign_keys=ON')
+
+    def _current_data_version(self):
+        # Changes whenever another connection commits to the database
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def load(self):
+        with self._lock:
+            data_version = self._current_data_version()
+            if self._config is not None and data_version == self._data_version:
+                return self._config
+
+            recipients = {}
+            for msg_id, recipient in self.conn.execute(
+                "SELECT msg_id, recipient FROM message_recipients ORDER BY msg_id, position"
+            ):
+                recipients.setdefault(msg_id, []).append(recipient)
+
+            messages = {}
+            for msg_id, text, image_paths, schedule, extra in self.conn.execute(
+                "SELECT msg_id, text, image_paths, schedule, extra FROM messages ORDER BY position"
+            ):
+                data = {
+                    'text': text,
+                    'image_paths': json.loads(image_paths),
+                    'recipients': recipients.get(msg_id, []),
+                    'schedule': json.loads(schedule) if schedule else None,
+                }
+                data.update(json.loads(extra))
+                messages[msg_id] = data
+
+            self._config = {'messages': messages}
+            self._data_version = data_version
+            self.version += 1
+            return self._config
+
+    def put_message(self, msg_id, data):
+        schedule = data.get('schedule') or None
+        recipients = data.get('recipients') or []
+        if isinstance(recipients, str):
+            recipients = [r.strip() for r in recipients.split(',') if r.strip()]
+        days = (schedule or {}).get('days') or ([schedule['day']] if (schedule or {}).get('day') else [])
+        extra = {k: v for k, v in data.items() if k not in SQLITE_MESSAGE_KEYS}
+
+        with self._lock:
+            config = self.load()
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                row = self.conn.execute(
+                    "SELECT position FROM messages WHERE msg_id = ?", (msg_id,)
+                ).fetchone()
+                if row:
+                    position = row[0]
+                else:
+                    position = self.conn.execute(
+                        "SELECT COALESCE(MAX(position), 0) + 1 FROM messages"
+                    ).fetchone()[0]
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO messages (msg_id, position, text, image_paths, schedule, "
+                    "schedule_type, schedule_time, timezone, extra, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        msg_id, position, data.get('text') or '',
+                        json.dumps(data.get('image_paths') or [], ensure_ascii=False),
+                        json.dumps(schedule, ensure_ascii=False) if schedule else None,
+                        schedule.get('type') if schedule else None,
+                        schedule.get('time') if schedule else None,
+                        schedule.get('timezone') if schedule else None,
+                        json.dumps(extra, ensure_ascii=False), time.time()
+                    )
+                )
+                self.conn.execute("DELETE FROM message_recipients WHERE msg_id = ?", (msg_id,))
+                self.conn.executemany(
+                    "INSERT INTO message_recipients (msg_id, position, recipient) VALUES (?, ?, ?)",
+                    [(msg_id, i, str(r)) for i, r in enumerate(recipients)]
+                )
+                self.conn.execute("DELETE FROM message_schedule_days WHERE msg_id = ?", (msg_id,))
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO message_schedule_days (msg_id, day) VALUES (?, ?)",
+                    [(msg_id, day) for day in days]
+                )
+            data = dict(data, recipients=[str(r) for r in recipients])
+            config['messages'][msg_id] = data
+            self._data_version = self._current_data_version()
+            self._changed(msg_id, data)
+
+    def delete_message(self, msg_id):
+        with self._lock:
+            config = self.load()
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.execute("DELETE FROM messages WHERE msg_id = ?", (msg_id,))
+            config['messages'].pop(msg_id, None)
+            self._data_version = self._current_data_version()
+            self._changed(msg_id)
+
+    def clear_messages(self):
+        with self._lock:
+            config = self.load()
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.execute("DELETE FROM messages")
+            config['messages'] = {}
+            self._data_version = self._current_data_version()
+            self._changed(cleared=True)
+
+    def scheduled_messages(self):
+        messages = self.load_messages()
+        scheduled_ids = self.conn.execute(
+            "SELECT msg_id FROM messages WHERE schedule_type IS NOT NULL ORDER BY position"
+        ).fetchall()
+        return {
+            msg_id: messages[msg_id] for (msg_id,) in scheduled_ids
+            if msg_id in messages and messages[msg_id].compiled_schedule is not None
+        }
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM messages LIMIT 1").fetchone() is None
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM storage_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO storage_meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def migrate_yaml_to_sqlite(yaml_store, sqlite_store):
+    """Copy every message from a YAML store into a SQLite store. Returns the count."""
+    messages = yaml_store.load().get('messages', {})
+    for msg_id, data in messages.items():
+        sqlite_store.put_message(msg_id, data)
+    sqlite_store.set_meta('migrated_from_yaml', yaml_store.path)
+    return len(messages)
+
+
+def _fsync_directory(directory):
+    """Make a rename inside `directory` durable (no-op where unsupported)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_migration_lock = threading.Lock()
+
+
+def _get_store(cls, path):
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = cls(path)
+        return store
+
+
+def get_yaml_path():
+    return os.getenv('MESSAGES_YAML', 'messages.yaml')
+
+
+def get_config_store(path=None):
+    """Return the process-wide YAML store for `path` (default: MESSAGES_YAML or messages.yaml)."""
+    return _get_store(YamlConfigStore, path or get_yaml_path())
+
+
+def get_sqlite_store(path=None):
+    return _get_store(SqliteConfigStore, path or os.getenv('MESSAGES_DB', 'messages.db'))
+
+
+def get_storage():
+    """Return the process-wide storage backend selected by STORAGE_BACKEND."""
+    backend = os.getenv('STORAGE_BACKEND', 'yaml').strip().lower()
+    if backend == 'yaml':
+        return get_config_store()
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+    store = get_sqlite_store()
+    with _migration_lock:
+        # One-shot migration the first time the SQLite backend is used
+        if store.is_empty() and not store.get_meta('migrated_from_yaml') and os.path.exists(get_yaml_path()):
+            count = migrate_yaml_to_sqlite(get_config_store(), store)
+            print(f"📦 Migrated {count} message(s) from {get_yaml_path()} to {store.path}")
+    return store
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python storage.py migrate [messages.yaml] [messages.db]")
+        sys.exit(1)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    yaml_store = get_config_store(sys.argv[2] if len(sys.argv) > 2 else None)
+    sqlite_store = get_sqlite_store(sys.argv[3] if len(sys.argv) > 3 else None)
+    count = migrate_yaml_to_sqlite(yaml_store, sqlite_store)
+    print(f"✓ Migrated {count} message(s) from {yaml_store.path} to {sqlite_store.path}")
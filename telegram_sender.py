@@ -5,18 +5,79 @@ Supports sending to groups, channels, and individual users.
 Supports sending text messages and images.
 """
 import os
+import sys
 import asyncio
-import yaml
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
+from telethon import errors
+from telethon.errors import SessionPasswordNeededError, FloodWaitError
+from telethon.helpers import generate_random_long
+from telethon.tl.functions.messages import ForwardMessagesRequest
+from telethon.tl.types import InputPeerSelf
 from dotenv import load_dotenv
+from storage import get_storage, get_yaml_path
+from models import Message
+from user_client import create_user_client, DEFAULT_SESSION
+from entity_cache import get_entity_cache, cache_key, INVALIDATING_ERRORS
+from rate_limit import get_rate_limiter
+from media import MediaUploader, FILE_REFERENCE_ERRORS
+from outbox import manual_slot
+from account_pool import MEMBERSHIP_ERRORS
 
 # Load environment variables
 load_dotenv()
 
+DEFAULT_FLOOD_WAIT_RETRIES = 2
+
+# With an outbox, longer FloodWaits are left to the outbox retry instead of holding up the delivery
+MAX_INLINE_FLOOD_WAIT = 60
+
+# Failures that retrying later will not fix; such deliveries are dead-lettered at once
+PERMANENT_ERRORS = INVALIDATING_ERRORS + (
+    errors.ChatWriteForbiddenError,
+    errors.ChatAdminRequiredError,
+    errors.UserBannedInChannelError,
+    errors.UserIsBlockedError,
+    errors.InputUserDeactivatedError,
+)
+
+
+def _as_list(result):
+    return list(result) if isinstance(result, (list, tuple)) else [result]
+
+
+class SenderAccount:
+    """One user account as used by the sender: its client, recipient cache and rate limits."""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.entity_cache = get_entity_cache(name)
+        self.rate_limiter = get_rate_limiter(name)
+        # Shared by every sender of this account, so SEND_CONCURRENCY holds per account
+        self.send_slots = self.rate_limiter.send_slots
+
+
+class AccountRun:
+    """Media handles and staged post of one delivery on one account, prepared on first use."""
+
+    def __init__(self, account, log_func):
+        self.account = account
+        self.media = MediaUploader(account.client, log_func, account=account.name)
+        self.staged = None
+        self.prepared = False
+        self.lock = asyncio.Lock()
+
+
+class StagedPost:
+    """A message posted once to Saved Messages, to be forwarded to every recipient."""
+    __slots__ = ('message_ids', 'drop_author')
+
+    def __init__(self, message_ids, drop_author=False):
+        self.message_ids = message_ids
+        self.drop_author = drop_author
+
 
 class TelegramSender:
-    def __init__(self, log_func=print):
+    def __init__(self, log_func=print, client_manager=None, outbox=None, account_pool=None):
         self.api_id = os.getenv('API_ID')
         self.api_hash = os.getenv('API_HASH')
         self.phone_number = os.getenv('PHONE_NUMBER')
@@ -30,105 +91,76 @@ class TelegramSender:
         # Support both old format (single message) and new format (multiple messages)
         self.messages_config = self._load_messages_config()
         
-        # Create client
-        self.client = TelegramClient('session', int(self.api_id), self.api_hash, device_model="Windows 11", system_version="10.0.22621", app_version="4.11.2")
+        # Use the bot's shared user client when given, otherwise create our own
+        self.client_manager = client_manager
+        if client_manager is not None:
+            self.client = client_manager.client
+        else:
+            self.client = create_user_client()
+        
+        self.account = client_manager.session if client_manager is not None else DEFAULT_SESSION
+        
+        # Concurrent fan-out to recipients, throttled per account and per chat.
+        # With an AccountPool, recipients are sharded over all of its authorized accounts.
+        self.primary = SenderAccount(self.account, self.client)
+        self.account_pool = account_pool
+        self._accounts = None
+        self.flood_retries = int(os.getenv('FLOOD_WAIT_RETRIES', DEFAULT_FLOOD_WAIT_RETRIES))
+        
+        # Optional DeliveryOutbox: makes deliveries idempotent per slot and retries failures later
+        self.outbox = outbox
     
     def _load_messages_config(self):
-        """Load messages configuration from YAML file or environment variables"""
+        """Load messages (as Message objects) from the message storage or environment variables"""
         configs = []
         
-        # Try to load from YAML file first
-        yaml_path = os.getenv('MESSAGES_YAML', 'messages.yaml')
-        if os.path.exists(yaml_path):
+        # Try to load from the configured storage (messages.yaml or messages.db) first
+        storage_backend = os.getenv('STORAGE_BACKEND', 'yaml').strip().lower()
+        if storage_backend != 'yaml' or os.path.exists(get_yaml_path()):
             try:
-                with open(yaml_path, 'r', encoding='utf-8') as f:
-                    yaml_config = yaml.safe_load(f)
-                    
-                if yaml_config and 'messages' in yaml_config:
-                    for msg_key, msg_config in yaml_config['messages'].items():
-                        recipients = msg_config.get('recipients', [])
-                        image_paths = msg_config.get('image_paths', [])
-                        text = msg_config.get('text', '')
-                        
-                        # Convert recipients to list if it's a string
-                        if isinstance(recipients, str):
-                            recipients = [r.strip() for r in recipients.split(',') if r.strip()]
-                        
-                        # Convert image_paths to list if it's a string
-                        if isinstance(image_paths, str):
-                            image_paths = [p.strip() for p in image_paths.split(',') if p.strip()]
-                        
-                        if recipients or text:
-                            configs.append({
-                                'message': text,
-                                'recipients': recipients,
-                                'image_paths': image_paths
-                            })
-                    
-                    if configs:
-                        return configs
+                messages = get_storage().load_messages()
+                configs = [m for m in messages.values() if m.recipients or m.text]
+                if configs:
+                    return configs
             except Exception as e:
-                self.log(f"⚠ Warning: Could not load YAML config: {e}")
+                self.log(f"⚠ Warning: Could not load message config: {e}")
                 self.log("   Falling back to environment variables")
         
         # Fallback to environment variables format
         # Check for new format: MESSAGE_1, RECIPIENTS_1, IMAGE_PATHS_1, etc.
         i = 1
         while True:
-            message_key = f'MESSAGE_{i}'
-            recipients_key = f'RECIPIENTS_{i}'
-            image_paths_key = f'IMAGE_PATHS_{i}'
-            
-            message = os.getenv(message_key)
-            recipients = os.getenv(recipients_key)
-            image_paths_str = os.getenv(image_paths_key)
+            message = os.getenv(f'MESSAGE_{i}')
+            recipients = os.getenv(f'RECIPIENTS_{i}')
+            image_paths = os.getenv(f'IMAGE_PATHS_{i}')
             
             # If no MESSAGE_X found, stop
             if not message and not recipients:
                 break
             
-            # Parse recipients
-            if recipients:
-                recipients_list = [r.strip() for r in recipients.split(',') if r.strip()]
-            else:
+            if not recipients:
                 # Fallback to old format
-                recipients_list = os.getenv('RECIPIENTS', os.getenv('GROUP_IDS', '')).split(',')
-                recipients_list = [r.strip() for r in recipients_list if r.strip()]
-            
-            # Parse image paths
-            if image_paths_str:
-                image_paths = [path.strip() for path in image_paths_str.split(',') if path.strip()]
-            else:
-                image_paths = []
+                recipients = os.getenv('RECIPIENTS', os.getenv('GROUP_IDS', ''))
             
-            if message or recipients_list:
-                configs.append({
-                    'message': message or '',
-                    'recipients': recipients_list,
-                    'image_paths': image_paths
-                })
+            config = Message.from_dict(f'MESSAGE_{i}', {
+                'text': message,
+                'recipients': recipients,
+                'image_paths': image_paths
+            })
+            if config.text or config.recipients:
+                configs.append(config)
             
             i += 1
         
         # If no numbered messages found, use old format (backward compatibility)
         if not configs:
-            recipients = os.getenv('RECIPIENTS', os.getenv('GROUP_IDS', ''))
-            recipients_list = [r.strip() for r in recipients.split(',') if r.strip()] if recipients else []
-            
-            message = os.getenv('MESSAGE', 'Hello from automated daily message!')
-            
-            image_paths_str = os.getenv('IMAGE_PATHS', os.getenv('IMAGE_PATH', ''))
-            if image_paths_str:
-                image_paths = [path.strip() for path in image_paths_str.split(',') if path.strip()]
-            else:
-                image_paths = []
-            
-            if recipients_list or message:
-                configs.append({
-                    'message': message,
-                    'recipients': recipients_list,
-                    'image_paths': image_paths
-                })
+            config = Message.from_dict('MESSAGE', {
+                'text': os.getenv('MESSAGE', 'Hello from automated daily message!'),
+                'recipients': os.getenv('RECIPIENTS', os.getenv('GROUP_IDS', '')),
+                'image_paths': os.getenv('IMAGE_PATHS', os.getenv('IMAGE_PATH', ''))
+            })
+            if config.recipients or config.text:
+                configs.append(config)
         
         return configs
     
@@ -155,107 +187,377 @@ class TelegramSender:
         else:
             self.log("✓ Already authenticated (using saved session)")
     
-    async def send_messages(self, specific_config=None):
+    async def send_messages(self, specific_config=None, slot=None):
         """
-        Send messages. If specific_config is provided, only sends that one.
-        Otherwise sends all from messages_config.
+        Send messages. If specific_config (a Message or a config dict) is provided,
+        only sends that one. Otherwise sends all from messages_config.
+        With an outbox, `slot` identifies the delivery (the scheduled fire time);
+        recipients that already received this slot are skipped.
         """
+        if isinstance(specific_config, dict):
+            specific_config = Message.from_dict(None, specific_config)
+        configs_to_send = [specific_config] if specific_config else self.messages_config
+        
+        if not specific_config and configs_to_send:
+            self.log(f"Found {len(self.messages_config)} message configuration(s)\n")
+        
+        if self.outbox is not None and slot is None:
+            slot = manual_slot()
+        await self._send_configs([(config, slot) for config in configs_to_send])
+    
+    async def send_scheduled(self, due, timeout=None):
+        """
+        Send every message due in one scheduler pass as a single delivery plan.
+        `due` is a list of (Message, slot) pairs; each message gets `timeout`
+        seconds of its own. Returns (sent, failed, timed_out) per pair.
+        """
+        return await self._send_configs(due, timeout=timeout)
+    
+    async def _send_configs(self, items, timeout=None):
         try:
-            me = await self.client.get_me()
+            if self.client_manager is not None:
+                me = await self.client_manager.get_me()
+            else:
+                me = await self.client.get_me()
             self.log(f"👤 Sending as: {me.first_name} (@{me.username})")
         except Exception as e:
             self.log(f"⚠ Could not get sender info: {e}")
-
-        configs_to_send = [specific_config] if specific_config else self.messages_config
         
-        if not configs_to_send:
+        outcomes = [(0, 0, False)] * len(items)
+        if not items:
             self.log("No messages to send.")
-            return
-        
-        total_sent = 0
-        total_failed = 0
+            return outcomes
         
-        if not specific_config:
-            self.log(f"Found {len(self.messages_config)} message configuration(s)\n")
-        
-        for config_idx, config in enumerate(configs_to_send, 1):
-            # Check both keys for compatibility
-            message = config.get('message') or config.get('text', '')
-            recipients = config.get('recipients', [])
-            image_paths = config.get('image_paths', [])
-            
-            if not recipients:
+        jobs = []
+        for config_idx, (config, slot) in enumerate(items, 1):
+            if not config.recipients:
                 self.log(f"⚠ Message {config_idx}: No recipients configured, skipping")
                 continue
             
-            self.log(f"📨 Message {config_idx}: Sending to {len(recipients)} recipient(s)...")
-            if image_paths:
-                self.log(f"   Images: {len(image_paths)} file(s)")
-            
-            sent_count = 0
-            failed_count = 0
-            
-            for recipient in recipients:
-                recipient = recipient.strip()
-                if not recipient:
+            recipients = config.recipients
+            if self.outbox is not None and config.msg_id is not None:
+                self.outbox.enqueue(config.msg_id, slot, [r.raw for r in recipients])
+                recipients = self._claim_from_outbox(config, slot)
+                if not recipients:
+                    self.log(f"⏭ Message {config_idx}: Nothing due (already sent or waiting for a retry), skipping")
                     continue
-                
-                try:
-                    # Check if this is a topic format: group_id:topic_id
-                    if ':' in recipient and not recipient.startswith('@'):
-                        # Format: group_id:topic_id (e.g., -1001234567890:123)
-                        parts = recipient.split(':', 1)
-                        if len(parts) == 2:
-                            group_id_str, topic_id_str = parts
-                            try:
-                                group_entity = await self.client.get_entity(int(group_id_str))
-                                topic_id = int(topic_id_str)
-
-                                # Send directly to topic thread ID (no explicit reply to the latest message)
-                                await self._send_message_with_images(
-                                    group_entity,
-                                    message,
-                                    image_paths,
-                                    topic_id=topic_id
-                                )
-                                self.log(f"✓ Message sent to topic {topic_id} in group {group_id_str}")
-                                
-                                sent_count += 1
-                                continue
-                            except ValueError as ve:
-                                # If parsing fails, treat as regular recipient
-                                pass
-                    
-                    # Regular recipient (group, channel, or user)
-                    # Try to parse as integer (for numeric IDs like group/channel IDs)
-                    try:
-                        recipient_int = int(recipient)
-                        entity = await self.client.get_entity(recipient_int)
-                    except ValueError:
-                        # If not an integer, treat as username (groups, channels, or users)
-                        # Examples: @mygroup, @channel, @username
-                        entity = await self.client.get_entity(recipient)
-                    
-                    # Send message with images
-                    await self._send_message_with_images(entity, message, image_paths)
-                    self.log(f"✓ Message sent to {recipient}")
-                    sent_count += 1
-                    
-                except Exception as e:
-                    self.log(f"✗ Failed to send message to {recipient}: {str(e)}")
-                    failed_count += 1
             
-            self.log(f"   Summary: {sent_count} sent, {failed_count} failed\n")
+            self.log(f"📨 Message {config_idx}: Sending to {len(recipients)} recipient(s)...")
+            if config.image_paths:
+                self.log(f"   Images: {len(config.image_paths)} file(s)")
+            jobs.append((config_idx, config, recipients, slot))
+        
+        results = await self._run_plan(
+            [(config, recipients, slot) for _, config, recipients, slot in jobs], timeout=timeout
+        )
+        
+        total_sent = 0
+        total_failed = 0
+        for (config_idx, _, _, _), (sent_count, failed_count, timed_out) in zip(jobs, results):
+            if timed_out:
+                self.log(f"   ⏱ Message {config_idx}: timed out after {timeout:.0f}s")
+            self.log(f"   Summary (message {config_idx}): {sent_count} sent, {failed_count} failed")
+            outcomes[config_idx - 1] = (sent_count, failed_count, timed_out)
             total_sent += sent_count
             total_failed += failed_count
         
         self.log(f"="*60)
         self.log(f"Total: {total_sent} sent, {total_failed} failed")
+        return outcomes
+    
+    async def retry_from_outbox(self, config, slot):
+        """Resend a delivery to its outbox items that are due for a retry. Returns (sent, failed)."""
+        recipients = self._claim_from_outbox(config, slot)
+        if not recipients:
+            return 0, 0
+        self.log(f"🔁 Retrying {config.msg_id} for {len(recipients)} recipient(s)...")
+        sent, failed, _ = (await self._run_plan([(config, recipients, slot)]))[0]
+        return sent, failed
     
-    async def _send_message_with_images(self, entity, message, image_paths, reply_to=None, topic_id=None):
+    def _claim_from_outbox(self, config, slot):
+        by_raw = {recipient.raw: recipient for recipient in config.recipients}
+        recipients = []
+        for raw in self.outbox.claim(config.msg_id, slot):
+            recipient = by_raw.get(raw)
+            if recipient is None:
+                # Removed from the message since the delivery started
+                self.outbox.mark_failed(config.msg_id, slot, raw, "recipient removed", permanent=True)
+            else:
+                recipients.append(recipient)
+        return recipients
+    
+    async def _run_plan(self, jobs, timeout=None):
+        """
+        Deliver several (config, recipients, slot) jobs as one plan. Work is grouped
+        by chat: every chat gets its messages in order, one after another, while
+        different chats are served concurrently. Media is uploaded (or staged, in
+        forward mode) once per message and account. With a `timeout`, each job has
+        that long from the start of the plan; deliveries it has not finished by then
+        fail with asyncio.TimeoutError, without affecting the other jobs.
+        Returns (sent, failed, timed_out) per job.
+        """
+        accounts = await self._get_accounts()
+        runs = {}
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        timed_out = [False] * len(jobs)
+        
+        by_peer = {}
+        for job_index, (config, recipients, slot) in enumerate(jobs):
+            for recipient in recipients:
+                by_peer.setdefault(cache_key(recipient.peer), []).append((job_index, recipient))
+        
+        async def deliver_to_peer(items):
+            outcomes = []
+            for job_index, recipient in items:
+                config = jobs[job_index][0]
+                try:
+                    if deadline is None:
+                        error = await self._deliver_sharded(accounts, runs, recipient, config)
+                    else:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        error = await asyncio.wait_for(
+                            self._deliver_sharded(accounts, runs, recipient, config), remaining
+                        )
+                except asyncio.TimeoutError:
+                    timed_out[job_index] = True
+                    error = asyncio.TimeoutError(f"timed out after {timeout:.0f}s")
+                outcomes.append((job_index, recipient, error))
+            return outcomes
+        
+        # Fan out concurrently; the rate limiters keep every account within Telegram's limits
+        try:
+            per_peer = await asyncio.gather(*(deliver_to_peer(items) for items in by_peer.values()))
+        finally:
+            for run in runs.values():
+                if run.staged is not None:
+                    await self._unstage(run)
+        
+        counts = [[0, 0] for _ in jobs]
+        for job_index, recipient, error in (outcome for outcomes in per_peer for outcome in outcomes):
+            config, _, slot = jobs[job_index]
+            if self.outbox is not None and config.msg_id is not None:
+                self._record_outcome(config.msg_id, slot, recipient, error)
+            counts[job_index][0 if error is None else 1] += 1
+        return [(sent, failed, timed_out[job_index]) for job_index, (sent, failed) in enumerate(counts)]
+    
+    async def _get_accounts(self):
+        """Accounts to deliver with: the primary one plus the authorized sessions of the pool."""
+        if self._accounts is None:
+            accounts = {self.primary.name: self.primary}
+            if self.account_pool is not None:
+                for name, manager in self.account_pool.managers.items():
+                    if name in accounts:
+                        continue
+                    try:
+                        client = await manager.get_authorized_client()
+                    except Exception as e:
+                        self.log(f"⚠ Account {name} unavailable, skipping: {e}")
+                        continue
+                    accounts[name] = SenderAccount(name, client)
+            self._accounts = accounts
+        return self._accounts
+    
+    def _accounts_for(self, accounts, recipient):
+        """Accounts to try for `recipient`, in order."""
+        if self.account_pool is None or len(accounts) == 1:
+            return list(accounts.values())
+        return [accounts[name] for name in self.account_pool.accounts_for(recipient.peer, available=accounts)]
+    
+    async def _get_run(self, runs, account, config):
+        run = runs.get((account.name, id(config)))
+        if run is None:
+            run = runs[(account.name, id(config))] = AccountRun(account, self.log)
+        async with run.lock:
+            if not run.prepared:
+                # Upload every file once (or reuse a stored reference) for all recipients
+                if config.image_paths:
+                    await run.media.prepare(config.image_paths)
+                # Forward mode: build the payload once, then each recipient costs one small forward call
+                if config.delivery == 'forward':
+                    run.staged = await self._stage(account, config, run.media)
+                run.prepared = True
+        return run
+    
+    async def _deliver_sharded(self, accounts, runs, recipient, config):
+        """
+        Deliver through the recipient's account. If that account cannot reach the
+        chat, fall back to the next account on the ring and remember it.
+        """
+        candidates = self._accounts_for(accounts, recipient)
+        for index, account in enumerate(candidates):
+            try:
+                run = await self._get_run(runs, account, config)
+            except Exception as e:
+                # E.g. an image was removed after scheduling: fail this recipient, not the plan
+                self.log(f"✗ Could not prepare message for {recipient.raw}: {str(e)}")
+                return e
+            error = await self._deliver(run, recipient, config.text)
+            if error is None:
+                if index:
+                    self.account_pool.mark_reachable(account.name, recipient.peer)
+                return None
+            if index + 1 == len(candidates) or not isinstance(error, MEMBERSHIP_ERRORS):
+                return error
+            self.account_pool.mark_unreachable(account.name, recipient.peer)
+            self.log(f"↪ {account.name} cannot reach {recipient.raw}, trying {candidates[index + 1].name}")
+        return error
+    
+    def _record_outcome(self, msg_id, slot, recipient, error):
+        if error is None:
+            self.outbox.mark_sent(msg_id, slot, recipient.raw)
+            return
+        dead = self.outbox.mark_failed(
+            msg_id, slot, recipient.raw, error,
+            retry_after=error.seconds if isinstance(error, FloodWaitError) else 0,
+            permanent=isinstance(error, PERMANENT_ERRORS)
+        )
+        if dead:
+            self.log(f"☠️ Giving up on {recipient.raw}: {error}")
+        else:
+            self.log(f"🔁 {recipient.raw} will be retried later")
+    
+    async def _stage(self, account, config, media):
+        """Post the message to Saved Messages for forward delivery. Returns a StagedPost, or None to send directly."""
+        generation = media.generation
+        try:
+            try:
+                sent = await self._send_message_with_images(
+                    InputPeerSelf(), config.text, media.items, client=account.client
+                )
+            except FILE_REFERENCE_ERRORS:
+                await media.refresh(generation)
+                sent = await self._send_message_with_images(
+                    InputPeerSelf(), config.text, media.items, client=account.client
+                )
+        except Exception as e:
+            self.log(f"⚠ Could not stage message in Saved Messages, sending directly: {e}")
+            return None
+        if not sent:
+            return None
+        self.log(f"   Forward mode: staged {len(sent)} message(s) in Saved Messages of {account.name}")
+        return StagedPost([m.id for m in sent], drop_author=config.hide_sender)
+    
+    async def _unstage(self, run):
+        try:
+            await run.account.client.delete_messages(InputPeerSelf(), run.staged.message_ids)
+        except Exception as e:
+            self.log(f"⚠ Could not remove staged message from Saved Messages: {e}")
+    
+    async def _deliver(self, run, recipient, message):
+        """Send to one recipient with rate limiting and FloodWait retries. Returns None or the error."""
+        account = run.account
+        lane = cache_key(recipient.peer)
+        for attempt in range(1, self.flood_retries + 2):
+            await account.rate_limiter.acquire(lane)
+            try:
+                async with account.send_slots:
+                    await self._resolve_and_send(run, recipient, message)
+                return None
+            except FloodWaitError as e:
+                # Pause only this chat's lane, then try the same recipient again
+                account.rate_limiter.flood_wait(lane, e.seconds)
+                deferred = self.outbox is not None and e.seconds > MAX_INLINE_FLOOD_WAIT
+                if attempt > self.flood_retries or deferred:
+                    self.log(f"✗ Failed to send message to {recipient.raw}: {str(e)}")
+                    return e
+                self.log(f"⏳ FloodWait {e.seconds}s for {recipient.raw}, retrying...")
+            except Exception as e:
+                self.log(f"✗ Failed to send message to {recipient.raw}: {str(e)}")
+                return e
+    
+    async def _resolve_and_send(self, run, recipient, message):
+        # Recipients are pre-parsed: numeric ID, @username or group_id:topic_id
+        entity_cache = run.account.entity_cache
+        client = run.account.client
+        entity = entity_cache.get(recipient.peer)
+        from_cache = entity is not None
+        if not from_cache:
+            entity = await entity_cache.resolve(client, recipient.peer)
+        
+        try:
+            await self._send_to_recipient(run, entity, recipient, message)
+        except INVALIDATING_ERRORS:
+            # The cached peer went stale: drop it and resolve once more
+            entity_cache.invalidate(recipient.peer)
+            if not from_cache:
+                raise
+            entity = await entity_cache.resolve(client, recipient.peer)
+            await self._send_to_recipient(run, entity, recipient, message)
+    
+    async def _send_to_recipient(self, run, entity, recipient, message):
+        client = run.account.client
+        media = run.media
+        generation = media.generation
+        try:
+            if run.staged is not None:
+                await self._forward_staged(client, entity, run.staged, topic_id=recipient.topic_id)
+            else:
+                await self._send_message_with_images(
+                    entity, message, media.items, topic_id=recipient.topic_id, client=client
+                )
+        except FILE_REFERENCE_ERRORS:
+            # A stored media reference expired: upload again (once for all recipients) and retry
+            await media.refresh(generation)
+            await self._send_message_with_images(
+                entity, message, media.items, topic_id=recipient.topic_id, client=client
+            )
+        
+        via = f" (via {run.account.name})" if run.account is not self.primary else ""
+        if recipient.topic_id is not None:
+            # Sent directly to topic thread ID (no explicit reply to the latest message)
+            self.log(f"✓ Message sent to topic {recipient.topic_id} in group {recipient.peer}{via}")
+        else:
+            self.log(f"✓ Message sent to {recipient.raw}{via}")
+    
+    async def prewarm_entities(self, config):
+        """Resolve and cache the recipients of a message ahead of time. Returns the failure count."""
+        accounts = await self._get_accounts()
+        failed = 0
+        for recipient in config.recipients:
+            account = self._accounts_for(accounts, recipient)[0]
+            try:
+                await account.entity_cache.resolve(account.client, recipient.peer)
+            except Exception as e:
+                self.log(f"⚠ Could not resolve {recipient.raw}: {e}")
+                failed += 1
+        return failed
+    
+    async def prewarm(self, config):
+        """
+        Get a scheduled message ready ahead of its fire time: resolve and cache
+        every recipient and upload the media on each account that will send it,
+        so at fire time only the send calls remain. Returns the resolve failure count.
+        """
+        failed = await self.prewarm_entities(config)
+        if config.image_paths:
+            accounts = await self._get_accounts()
+            used = {self._accounts_for(accounts, recipient)[0] for recipient in config.recipients}
+            for account in used:
+                # Fills the persistent media reference cache used by the real send
+                await MediaUploader(account.client, self.log, account=account.name).prepare(config.image_paths)
+        return failed
+    
+    async def _forward_staged(self, client, entity, staged, topic_id=None):
+        """Forward a staged post (all album parts in one request) to `entity`."""
+        await client(ForwardMessagesRequest(
+            from_peer=InputPeerSelf(),
+            id=staged.message_ids,
+            to_peer=entity,
+            random_id=[generate_random_long() for _ in staged.message_ids],
+            drop_author=staged.drop_author or None,
+            top_msg_id=topic_id
+        ))
+    
+    async def _send_message_with_images(self, entity, message, media, reply_to=None, topic_id=None, client=None):
         """
         Send message with images. All images are sent in one message with text as caption.
+        `media` is a list of prepared media handles (see MediaUploader) or file paths.
+        Returns the list of sent messages.
         """
+        client = client or self.client
         send_kwargs = {}
         if topic_id is not None:
             # For forum topics we pass thread id directly, avoiding explicit reply to a concrete message
@@ -263,38 +565,32 @@ class TelegramSender:
         elif reply_to is not None:
             send_kwargs['reply_to'] = reply_to
 
-        # Filter valid image files
-        valid_images = [img for img in image_paths if os.path.exists(img)]
-        
-        if valid_images:
-            # Check for missing files
-            for img_path in image_paths:
-                if img_path not in valid_images:
-                    self.log(f"⚠ Warning: Image file not found: {img_path}")
-            
+        sent = []
+        if media:
             # Send all images. If multiple, Telethon treats them as an album.
             # For albums, the caption is attached to the FIRST file.
             try:
-                await self.client.send_file(
+                sent += _as_list(await client.send_file(
                     entity,
-                    valid_images,
+                    list(media),
                     caption=message if message else None,
                     **send_kwargs
-                )
+                ))
             except Exception as e:
                 # Fallback: if sending album with caption fails, try sending text separately
                 self.log(f"⚠ Failed to send with caption, trying separate: {e}")
-                await self.client.send_file(entity, valid_images, **send_kwargs)
+                sent += _as_list(await client.send_file(entity, list(media), **send_kwargs))
                 if message:
-                    await self.client.send_message(entity, message, **send_kwargs)
+                    sent.append(await client.send_message(entity, message, **send_kwargs))
         else:
             # No valid images, send text only
             if message:
-                await self.client.send_message(
+                sent.append(await client.send_message(
                     entity,
                     message,
                     **send_kwargs
-                )
+                ))
+        return sent
     
     async def run(self):
         """Main execution method"""
@@ -302,11 +598,21 @@ class TelegramSender:
             await self.authenticate()
             await self.send_messages()
         finally:
-            await self.client.disconnect()
+            if self.client_manager is None:
+                await self.client.disconnect()
 
 
 async def main():
     """Entry point for the script"""
+    # python3 telegram_sender.py --auth NAME: log in an extra account listed in USER_SESSIONS
+    if len(sys.argv) == 3 and sys.argv[1] == '--auth':
+        client = create_user_client(sys.argv[2])
+        await client.start()
+        me = await client.get_me()
+        print(f"✓ Session '{sys.argv[2]}' authorized as {me.first_name} (@{me.username})")
+        await client.disconnect()
+        return
+    
     sender = TelegramSender()
     await sender.run()
 
@@ -0,0 +1,151 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telethon')
+
+import cleanup  # noqa: E402
+from cleanup import CleanupCheckpoints, KeywordMatcher, normalize_text  # noqa: E402
+
+
+def test_normalize_text_folds_case_width_and_spacing():
+    assert normalize_text('  ＳＰＡＭ\tHere  ') == 'spam here'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Buy SPAM now', True),
+    ('spammer', True),           # prefix of a word, like Telegram search
+    ('antispam', False),         # not at the start of a word
+    ('ｓｐａｍ', True),           # full-width
+    ('cheap   eggs today', True),
+    ('cheap egg', False),
+    ('', False),
+    (None, False),
+])
+def test_keyword_matcher(text, expected):
+    matcher = KeywordMatcher(['spam', 'Cheap Eggs'])
+    assert matcher.matches(text) is expected
+
+
+def test_keyword_matcher_escapes_regex_characters():
+    matcher = KeywordMatcher(['c++', 'a.b'])
+    assert matcher.matches('I like c++ a lot')
+    assert not matcher.matches('axb')
+
+
+class FakeClient:
+    """One private chat whose history is returned newest first, like iter_messages()."""
+
+    def __init__(self, count, every):
+        self.entity = SimpleNamespace(creator=False)
+        self.dialog = SimpleNamespace(id=1, name='chat', entity=self.entity, is_user=True)
+        self.messages = [
+            SimpleNamespace(id=i, message='spam' if i % every == 0 else 'hello', out=True)
+            for i in range(count, 0, -1)
+        ]
+
+    async def get_dialogs(self, limit=None):
+        return [self.dialog]
+
+    def iter_messages(self, entity, offset_id=0, search=None, **kwargs):
+        async def messages():
+            for message in list(self.messages):
+                if not offset_id or message.id < offset_id:
+                    yield message
+        return messages()
+
+    async def delete_messages(self, entity, message_ids, revoke=True):
+        ids = set(message_ids)
+        self.messages = [m for m in self.messages if m.id not in ids]
+
+    def remaining_matches(self):
+        return [m.id for m in self.messages if m.message == 'spam']
+
+
+class CrashingCheckpoints(CleanupCheckpoints):
+    """Stops the scan right after the first checkpoint that moves the offset."""
+
+    crashed = False
+
+    def save(self, checkpoint):
+        super().save(checkpoint)
+        if checkpoint.last_id and not self.crashed and not checkpoint.done:
+            self.crashed = True
+            raise RuntimeError('stopped')
+
+
+def test_resumed_scan_deletes_the_checkpointed_message(tmp_path):
+    client = FakeClient(count=1402, every=7)
+    store = CrashingCheckpoints(str(tmp_path / 'state.db'))
+
+    first = asyncio.run(cleanup.delete_messages_by_keywords(
+        client, ['spam'], mode='history', concurrency=1, checkpoints=store, prefilter=False
+    ))
+    assert first['failed_chats']
+    assert client.remaining_matches()
+
+    second = asyncio.run(cleanup.delete_messages_by_keywords(
+        client, ['spam'], mode='history', concurrency=1, checkpoints=store, prefilter=False
+    ))
+    assert second['resumed']
+    assert not second['failed_chats']
+    assert client.remaining_matches() == []
+    assert second['deleted_count'] == 1402 // 7
+
+
+def test_completed_job_clears_its_checkpoints(tmp_path):
+    client = FakeClient(count=50, every=5)
+    store = CleanupCheckpoints(str(tmp_path / 'state.db'))
+    result = asyncio.run(cleanup.delete_messages_by_keywords(
+        client, ['spam'], mode='history', checkpoints=store, prefilter=False
+    ))
+    assert result['deleted_count'] == 10
+    assert store.interrupted_jobs() == []
+    assert store.conn.execute('SELECT COUNT(*) FROM cleanup_checkpoints').fetchone()[0] == 0
+
+
+class CountingClient(FakeClient):
+    """FakeClient with a second keyword in the history that counts history walks."""
+
+    def __init__(self, count, every):
+        super().__init__(count, every)
+        for message in self.messages:
+            if message.id % every == 1:
+                message.message = 'cheap eggs'
+        self.walks = 0
+
+    def iter_messages(self, entity, offset_id=0, search=None, **kwargs):
+        self.walks += 1
+        return super().iter_messages(entity, offset_id=offset_id, search=search, **kwargs)
+
+
+def test_history_mode_walks_each_chat_once_for_all_keywords():
+    client = CountingClient(count=70, every=7)
+    result = asyncio.run(cleanup.delete_messages_by_keywords(
+        client, ['spam', 'Cheap Eggs'], mode='history', prefilter=False
+    ))
+    assert client.walks == 1
+    assert result['deleted_count'] == 20
+    assert [m.message for m in client.messages if m.message != 'hello'] == []
+
+
+class BrokenIndex:
+    """Claims the chat is indexed, then fails the lookup halfway through the job."""
+
+    def indexed_chats(self):
+        return {1}
+
+    def find(self, matcher):
+        raise RuntimeError('index unavailable')
+
+
+def test_failed_job_is_not_resumed_automatically(tmp_path):
+    client = FakeClient(count=50, every=5)
+    store = CleanupCheckpoints(str(tmp_path / 'state.db'))
+    with pytest.raises(RuntimeError):
+        asyncio.run(cleanup.delete_messages_by_keywords(
+            client, ['spam'], mode='history', checkpoints=store, index=BrokenIndex(), prefilter=False
+        ))
+    assert store.conn.execute('SELECT status FROM cleanup_jobs').fetchall() == [('incomplete',)]
+    assert store.interrupted_jobs() == []
@@ -0,0 +1,91 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from scheduler import CronSchedule, compile_schedule, compile_schedule_strict, parse_cron
+
+UTC = timezone.utc
+LISBON = ZoneInfo('Europe/Lisbon')
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=UTC)
+
+
+def test_parse_cron_fields():
+    minutes, hours, month_days, months, weekdays, dom_restricted, dow_restricted = parse_cron('*/15 9-17 * jan,jul 1-5')
+    assert minutes == [0, 15, 30, 45]
+    assert hours == list(range(9, 18))
+    assert months == [1, 7]
+    assert weekdays == frozenset({1, 2, 3, 4, 5})
+    assert not dom_restricted and dow_restricted
+
+
+def test_parse_cron_macro_and_sunday_as_seven():
+    assert parse_cron('@daily')[:2] == ([0], [0])
+    assert parse_cron('0 0 * * 7')[4] == frozenset({0})
+
+
+@pytest.mark.parametrize('expr', ['', '* * * *', '60 * * * *', '* 24 * * *', '*/0 * * * *', '5-1 * * * *', 'x * * * *'])
+def test_parse_cron_rejects_malformed_expressions(expr):
+    with pytest.raises(ValueError):
+        parse_cron(expr)
+
+
+def test_cron_next_after_weekdays():
+    schedule = CronSchedule('30 9 * * 1-5', UTC)
+    # Friday 2024-03-01 10:00 -> Monday 09:30
+    assert schedule.next_after(utc(2024, 3, 1, 10, 0)) == utc(2024, 3, 4, 9, 30)
+    # Strictly after: the same minute is not returned again
+    assert schedule.next_after(utc(2024, 3, 4, 9, 30)) == utc(2024, 3, 5, 9, 30)
+
+
+def test_cron_day_of_month_or_day_of_week():
+    # Both restricted: the 13th OR any Friday, like classic cron
+    schedule = CronSchedule('0 12 13 * 5', UTC)
+    assert schedule.next_after(utc(2024, 9, 10, 0, 0)) == utc(2024, 9, 13, 12, 0)
+    assert schedule.next_after(utc(2024, 9, 13, 12, 0)) == utc(2024, 9, 20, 12, 0)
+
+
+def test_cron_skips_to_next_matching_month_and_leap_day():
+    schedule = CronSchedule('0 0 29 2 *', UTC)
+    assert schedule.next_after(utc(2024, 3, 1, 0, 0)) == utc(2028, 2, 29, 0, 0)
+
+
+def test_daily_schedule_in_timezone_across_dst():
+    schedule = compile_schedule({'type': 'daily', 'time': '09:00', 'timezone': 'Europe/Lisbon'})
+    # Winter: Lisbon is UTC+0, summer: UTC+1 (clocks change on 2024-03-31)
+    assert schedule.next_after(utc(2024, 3, 30, 10, 0)) == utc(2024, 3, 31, 8, 0)
+    assert schedule.next_after(utc(2024, 3, 29, 10, 0)) == utc(2024, 3, 30, 9, 0)
+
+
+def test_daily_schedule_at_nonexistent_local_time_still_fires():
+    # 01:30 does not exist in Lisbon on 2024-03-31 (01:00 -> 02:00)
+    schedule = compile_schedule({'type': 'daily', 'time': '01:30', 'timezone': 'Europe/Lisbon'})
+    fire_time = schedule.next_after(utc(2024, 3, 30, 12, 0))
+    assert utc(2024, 3, 31, 0, 0) <= fire_time <= utc(2024, 3, 31, 2, 0)
+
+
+def test_weekly_schedule():
+    schedule = compile_schedule({'type': 'weekly', 'time': '18:00', 'days': ['Monday', 'Friday'], 'timezone': 'UTC'})
+    # Wednesday -> Friday, Friday evening -> Monday
+    assert schedule.next_after(utc(2024, 3, 6, 12, 0)) == utc(2024, 3, 8, 18, 0)
+    assert schedule.next_after(utc(2024, 3, 8, 18, 0)) == utc(2024, 3, 11, 18, 0)
+
+
+@pytest.mark.parametrize('schedule', [
+    {'type': 'daily', 'time': '25:00'},
+    {'type': 'weekly', 'time': '09:00', 'days': []},
+    {'type': 'cron', 'cron': 'not a cron'},
+    {'type': 'daily', 'time': '09:00', 'timezone': 'Mars/Olympus'},
+    {'type': 'hourly', 'time': '09:00'},
+])
+def test_invalid_schedules(schedule):
+    with pytest.raises(ValueError):
+        compile_schedule_strict(schedule)
+    assert compile_schedule(schedule) is None
+
+
+def test_manual_schedule():
+    assert compile_schedule(None) is None
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('telethon')
+
+from telethon import errors  # noqa: E402
+from telethon.tl.functions.messages import SendMessageRequest, GetHistoryRequest  # noqa: E402
+from telethon.tl.types import InputPeerChat, UpdatesTooLong  # noqa: E402
+
+from flood_governor import FloodGovernor, GovernedTelegramClient  # noqa: E402
+
+
+def send(chat_id):
+    return SendMessageRequest(peer=InputPeerChat(chat_id), message='hi')
+
+
+def flood(seconds):
+    return errors.FloodWaitError(request=None, capture=seconds)
+
+
+class FakeSender:
+    """Answers sends to the chats in `flooded` with a FloodWait, everything else with a result."""
+
+    def __init__(self, flooded, seconds=120):
+        self.flooded = flooded
+        self.seconds = seconds
+        self.sent = []
+
+    def send(self, request, ordered=False):
+        self.sent.append(request.peer.chat_id)
+        future = asyncio.get_running_loop().create_future()
+        if request.peer.chat_id in self.flooded:
+            future.set_exception(errors.FloodWaitError(request=request, capture=self.seconds))
+        else:
+            future.set_result(UpdatesTooLong())
+        return future
+
+
+def test_send_flood_wait_pauses_only_that_chat():
+    governor = FloodGovernor()
+    governor.report(send(1), flood(30))
+    assert governor.backoff_remaining('messages.SendMessageRequest', '-1') > 0
+    assert governor.backoff_remaining('messages.SendMessageRequest', '-2') == 0
+    assert governor.backoff_remaining('messages.SendMessageRequest') == 0
+
+
+def test_other_flood_waits_block_the_method():
+    governor = FloodGovernor()
+    request = GetHistoryRequest(
+        peer=InputPeerChat(1), offset_id=0, offset_date=None, add_offset=0,
+        limit=100, max_id=0, min_id=0, hash=0
+    )
+    governor.report(request, flood(30))
+    assert governor.backoff_remaining('messages.GetHistoryRequest') > 0
+    assert governor.backoff_remaining() > 0
+
+
+def test_send_flood_wait_through_client_does_not_block_other_chats():
+    governor = FloodGovernor()
+    sender = FakeSender(flooded={1})
+
+    async def run():
+        client = GovernedTelegramClient(None, 1, 'hash', governor=governor)
+        with pytest.raises(errors.FloodWaitError):
+            await client._call(sender, send(1))
+        return await client._call(sender, send(2))
+
+    assert isinstance(asyncio.run(run()), UpdatesTooLong)
+    assert sender.sent == [1, 2]
+    assert governor.backoff_remaining('messages.SendMessageRequest', '-1') > 0
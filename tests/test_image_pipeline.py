@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from image_pipeline import _optimize_file, derived_path  # noqa: E402
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / 'photo.png'
+    Image.new('RGBA', (4000, 1000), (255, 0, 0, 128)).save(path)
+    return str(path)
+
+
+def test_optimize_downscales_to_jpeg(photo):
+    dst = _optimize_file(photo, derived_path(photo), 2560, 87)
+    with Image.open(dst) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (2560, 640)
+    assert not os.path.exists(f"{dst}.tmp")
+
+
+def test_failed_save_leaves_no_temp_file(photo, monkeypatch):
+    def broken_save(self, fp, *args, **kwargs):
+        with open(fp, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(Image.Image, 'save', broken_save)
+    dst = derived_path(photo)
+    with pytest.raises(OSError):
+        _optimize_file(photo, dst, 2560, 87)
+    assert not os.path.exists(f"{dst}.tmp")
+    assert not os.path.exists(dst)
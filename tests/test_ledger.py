@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import ledger
+from ledger import FireLedger, slot_key
+
+
+@pytest.fixture
+def fire_ledger(tmp_path):
+    return FireLedger(str(tmp_path / 'state.db'))
+
+
+class Py310Datetime(datetime):
+    """datetime whose fromisoformat() rejects the 'Z' suffix, like Python 3.10."""
+
+    @classmethod
+    def fromisoformat(cls, value):
+        if value.endswith('Z'):
+            raise ValueError(f"Invalid isoformat string: {value!r}")
+        return super().fromisoformat(value)
+
+
+def test_slot_key_is_utc_minute():
+    fire_time = datetime(2024, 3, 1, 12, 30, 45, tzinfo=timezone(timedelta(hours=2)))
+    assert slot_key(fire_time) == '2024-03-01T10:30Z'
+
+
+def test_claim_is_idempotent(fire_ledger):
+    fire_time = datetime(2024, 3, 1, 10, 30, tzinfo=timezone.utc)
+    assert fire_ledger.claim('m1', fire_time)
+    assert not fire_ledger.claim('m1', fire_time)
+    assert fire_ledger.claim('m2', fire_time)
+
+
+@pytest.mark.parametrize('datetime_cls', [datetime, Py310Datetime])
+def test_recover_interrupted_round_trips_slot_keys(fire_ledger, monkeypatch, datetime_cls):
+    monkeypatch.setattr(ledger, 'datetime', datetime_cls)
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    recent = now - timedelta(minutes=5)
+    old = now - timedelta(hours=3)
+    done = now - timedelta(minutes=1)
+
+    fire_ledger.claim('recent', recent)
+    fire_ledger.claim('old', old)
+    fire_ledger.claim('done', done)
+    fire_ledger.complete('done', done)
+
+    recovered = fire_ledger.recover_interrupted(since=now - timedelta(minutes=30))
+    assert recovered == [('recent', recent)]
+    # Released slots can be claimed again; completed ones cannot
+    assert fire_ledger.claim('recent', recent)
+    assert fire_ledger.claim('old', old)
+    assert not fire_ledger.claim('done', done)
+
+
+def test_legacy_local_slot_is_parsed_as_local_time():
+    moment = ledger._parse_moment('2024-03-01T10:30')
+    assert moment.tzinfo is not None
+    assert moment.replace(tzinfo=None) == datetime(2024, 3, 1, 10, 30)
+
+
+def test_watermark_round_trip(fire_ledger):
+    moment = datetime(2024, 3, 1, 10, 30, 15, tzinfo=timezone.utc)
+    assert fire_ledger.get_watermark() is None
+    fire_ledger.set_watermark(moment)
+    assert fire_ledger.get_watermark() == moment
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip('telethon')
+
+from telethon.tl.types import InputMediaPhoto, MessageMediaPhoto, Photo  # noqa: E402
+
+import media  # noqa: E402
+from media import MediaCache, MediaUploader  # noqa: E402
+
+
+class FakeClient:
+    """Counts uploads; every uploadMedia call returns a new photo."""
+
+    def __init__(self, fail=False):
+        self.uploads = 0
+        self.fail = fail
+
+    async def upload_file(self, path):
+        if self.fail:
+            raise ConnectionError('offline')
+        self.uploads += 1
+        return object()
+
+    async def __call__(self, request):
+        photo = Photo(
+            id=self.uploads, access_hash=42, file_reference=b'ref%d' % self.uploads,
+            date=datetime.now(timezone.utc), sizes=[], dc_id=2
+        )
+        return MessageMediaPhoto(photo=photo)
+
+
+@pytest.fixture
+def image(tmp_path, monkeypatch):
+    monkeypatch.setattr(media, '_caches', {'session': MediaCache(path=str(tmp_path / 'state.db'))})
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(b'\xff\xd8 not really a jpeg')
+    return str(path)
+
+
+def test_file_is_uploaded_once_and_reused_from_the_cache(image):
+    client = FakeClient()
+    items = asyncio.run(MediaUploader(client, log_func=lambda _: None).prepare([image]))
+    assert isinstance(items[0], InputMediaPhoto)
+    assert client.uploads == 1
+
+    # A later delivery of the same file uses the stored reference
+    again = asyncio.run(MediaUploader(client, log_func=lambda _: None).prepare([image]))
+    assert again[0].id.file_reference == items[0].id.file_reference
+    assert client.uploads == 1
+
+
+def test_refresh_uploads_again_once_per_generation(image):
+    client = FakeClient()
+    uploader = MediaUploader(client, log_func=lambda _: None)
+
+    async def run():
+        await uploader.prepare([image])
+        return await asyncio.gather(*(uploader.refresh(0) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert client.uploads == 2
+    assert uploader.generation == 1
+    assert all(result[0].id.file_reference == b'ref2' for result in results)
+
+
+def test_missing_file_is_skipped_and_failed_upload_falls_back_to_path(image, tmp_path):
+    logs = []
+    uploader = MediaUploader(FakeClient(fail=True), log_func=logs.append)
+    items = asyncio.run(uploader.prepare([str(tmp_path / 'missing.jpg'), image]))
+    assert items == [image]
+    assert len(logs) == 2
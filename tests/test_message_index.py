@@ -0,0 +1,152 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telethon')
+
+import cleanup  # noqa: E402
+import message_index  # noqa: E402
+from cleanup import KeywordMatcher  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not message_index.fts5_available(), reason="SQLite without FTS5")
+
+
+@pytest.fixture
+def index(tmp_path):
+    return message_index.MessageIndex(str(tmp_path / 'index.db'))
+
+
+def message(msg_id, text, out=True):
+    return SimpleNamespace(id=msg_id, message=text, out=out)
+
+
+def test_find_matches_like_keyword_matcher(index):
+    index.add(1, message(10, 'Buy SPAM now'))
+    index.add(1, message(11, 'antispam'))
+    index.add(2, message(20, 'ｓｐａｍｍｅｒ', out=False))
+    index.add(2, message(21, 'nothing here'))
+
+    assert index.find(KeywordMatcher(['spam'])) == {1: [(10, True)], 2: [(20, False)]}
+
+
+def test_edits_and_deletions_update_the_index(index):
+    index.add(1, message(10, 'spam'))
+    index.add(1, message(10, 'edited'))
+    assert index.find(KeywordMatcher(['spam'])) == {}
+
+    index.add(1, message(11, 'spam again'))
+    index.remove(1, [11])
+    assert index.find(KeywordMatcher(['spam'])) == {}
+
+
+def test_find_runs_in_a_worker_thread(index):
+    for i in range(1, 201):
+        index.add(1, message(i, 'spam' if i % 2 else 'ham'))
+
+    async def find_while_writing():
+        search = asyncio.create_task(asyncio.to_thread(index.find, KeywordMatcher(['spam'])))
+        for i in range(201, 301):
+            index.add(2, message(i, 'spam'))
+            await asyncio.sleep(0)
+        return await search
+
+    hits = asyncio.run(find_while_writing())
+    assert len(hits[1]) == 100
+
+
+class FakeClient:
+    """One private chat; history newest first, like iter_messages()."""
+
+    def __init__(self, texts):
+        self.entity = SimpleNamespace(creator=False)
+        self.messages = [message(i, text) for i, text in enumerate(texts, start=1)]
+        self.deleted = []
+
+    @property
+    def dialog(self):
+        return SimpleNamespace(id=1, name='chat', entity=self.entity, is_user=True, message=self.messages[-1])
+
+    async def catch_up(self):
+        pass
+
+    async def get_dialogs(self, limit=None):
+        return [self.dialog]
+
+    def iter_messages(self, entity, offset_id=0, min_id=0, **kwargs):
+        async def messages():
+            for m in reversed(self.messages):
+                if (not offset_id or m.id < offset_id) and m.id > min_id:
+                    yield m
+        return messages()
+
+    async def get_messages(self, entity, ids):
+        by_id = {m.id: m for m in self.messages}
+        return [by_id.get(i) for i in ids]
+
+    async def delete_messages(self, entity, message_ids, revoke=True):
+        self.deleted += message_ids
+
+
+def test_index_is_used_only_after_a_sync(index):
+    client = FakeClient(['spam', 'ham'])
+    asyncio.run(index.sync(client, log_func=lambda _: None))
+    assert index.indexed_chats() == {1}
+
+    # A restarted bot has the chat marked done on disk, but has not caught up yet
+    restarted = message_index.MessageIndex(index.path)
+    assert restarted.indexed_chats() == set()
+
+
+def test_sync_picks_up_edits_made_while_offline(index):
+    client = FakeClient(['spam', 'ham', 'hello'])
+    asyncio.run(index.sync(client, log_func=lambda _: None))
+    assert index.find(KeywordMatcher(['spam'])) == {1: [(1, True)]}
+
+    client.messages[0].message = 'edited'
+    client.messages[1].message = 'more spam'
+    client.messages.append(message(4, 'spam too'))
+    restarted = message_index.MessageIndex(index.path)
+    asyncio.run(restarted.sync(client, log_func=lambda _: None))
+    assert restarted.find(KeywordMatcher(['spam'])) == {1: [(2, True), (4, True)]}
+
+
+def test_stale_hits_are_corrected_instead_of_deleted(index):
+    client = FakeClient(['spam', 'spam', 'spam'])
+    asyncio.run(index.sync(client, log_func=lambda _: None))
+    # Edited and deleted after the index saw them, without an update reaching it
+    client.messages[0].message = 'edited'
+    del client.messages[1]
+
+    totals = {'deleted_count': 0, 'matched_count': 0}
+    matcher = KeywordMatcher(['spam'])
+    hits = index.find(matcher)[1]
+    asyncio.run(cleanup.delete_indexed(client, client.dialog, totals, hits, index, matcher))
+    assert client.deleted == [3]
+    assert totals['deleted_count'] == 1
+    assert index.find(matcher) == {}
+
+
+class FakeEvent:
+    def __init__(self, chat, msg, is_private=False):
+        self.chat_id = 5
+        self.is_channel = not is_private
+        self.is_group = True
+        self.is_private = is_private
+        self.out = msg.out
+        self.message = msg
+        self._chat = chat
+
+    async def get_chat(self):
+        return self._chat
+
+
+def test_live_handler_skips_incoming_where_cleanup_cannot_delete(index):
+    supergroup = SimpleNamespace(creator=False, admin_rights=None)
+
+    async def receive():
+        await index._on_message(FakeEvent(supergroup, message(1, 'spam', out=False)))
+        await index._on_message(FakeEvent(supergroup, message(2, 'spam', out=True)))
+
+    asyncio.run(receive())
+    assert index.find(KeywordMatcher(['spam'])) == {5: [(2, True)]}
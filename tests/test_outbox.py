@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+import outbox
+from outbox import STATUS_DEAD, STATUS_SENT, DeliveryOutbox
+
+
+@pytest.fixture
+def delivery_outbox(tmp_path):
+    return DeliveryOutbox(str(tmp_path / 'state.db'), max_attempts=3, retry_base=60)
+
+
+def status(delivery_outbox, recipient):
+    return delivery_outbox.conn.execute(
+        "SELECT status, attempts, last_error FROM outbox WHERE recipient = ?", (recipient,)
+    ).fetchone()
+
+
+def test_enqueue_and_claim(delivery_outbox):
+    delivery_outbox.enqueue('m1', 'slot', ['@a', '@b'])
+    assert sorted(delivery_outbox.claim('m1', 'slot')) == ['@a', '@b']
+    # Leased items are not handed out twice
+    assert delivery_outbox.claim('m1', 'slot') == []
+    assert delivery_outbox.due_deliveries() == []
+
+
+def test_refiring_a_slot_skips_sent_recipients(delivery_outbox):
+    delivery_outbox.enqueue('m1', 'slot', ['@a', '@b'])
+    delivery_outbox.claim('m1', 'slot')
+    delivery_outbox.mark_sent('m1', 'slot', '@a')
+    delivery_outbox.mark_failed('m1', 'slot', '@b', 'boom')
+
+    delivery_outbox.enqueue('m1', 'slot', ['@a', '@b'])
+    assert status(delivery_outbox, '@a')[0] == STATUS_SENT
+    assert status(delivery_outbox, '@b')[1] == 1
+
+
+def test_mark_failed_backs_off_exponentially(delivery_outbox, monkeypatch):
+    monkeypatch.setattr(outbox.random, 'uniform', lambda low, high: 1.0)
+    delivery_outbox.enqueue('m1', 'slot', ['@a'])
+
+    delivery_outbox.mark_failed('m1', 'slot', '@a', 'boom')
+    assert delivery_outbox.next_attempt_in() == pytest.approx(60, abs=2)
+    delivery_outbox.mark_failed('m1', 'slot', '@a', 'boom')
+    assert delivery_outbox.next_attempt_in() == pytest.approx(120, abs=2)
+
+    # A FloodWait longer than the backoff wins
+    delivery_outbox.enqueue('m2', 'slot', ['@b'])
+    delivery_outbox.mark_failed('m2', 'slot', '@b', 'flood', retry_after=900)
+    row = delivery_outbox.conn.execute("SELECT next_attempt_at FROM outbox WHERE recipient = '@b'").fetchone()
+    assert row[0] - time.time() == pytest.approx(900, abs=2)
+
+
+def test_dead_letter_after_max_attempts(delivery_outbox):
+    delivery_outbox.enqueue('m1', 'slot', ['@a'])
+    assert not delivery_outbox.mark_failed('m1', 'slot', '@a', 'boom')
+    assert not delivery_outbox.mark_failed('m1', 'slot', '@a', 'boom')
+    assert delivery_outbox.mark_failed('m1', 'slot', '@a', 'boom')
+    assert status(delivery_outbox, '@a') == (STATUS_DEAD, 3, 'boom')
+    assert delivery_outbox.next_attempt_in() is None
+
+
+def test_permanent_failure_and_drop(delivery_outbox):
+    delivery_outbox.enqueue('m1', 'slot', ['@a', '@b', '@c'])
+    assert delivery_outbox.mark_failed('m1', 'slot', '@a', 'no access', permanent=True)
+    delivery_outbox.mark_sent('m1', 'slot', '@b')
+    delivery_outbox.drop('m1', 'slot', 'message removed')
+    assert status(delivery_outbox, '@a')[0] == STATUS_DEAD
+    assert status(delivery_outbox, '@b')[0] == STATUS_SENT
+    assert status(delivery_outbox, '@c') == (STATUS_DEAD, 0, 'message removed')
+
+
+def test_due_deliveries_after_backoff(delivery_outbox):
+    delivery_outbox.enqueue('m1', 'slot', ['@a'])
+    delivery_outbox.mark_failed('m1', 'slot', '@a', 'boom')
+    assert delivery_outbox.due_deliveries() == []
+    delivery_outbox.conn.execute("UPDATE outbox SET next_attempt_at = ?", (time.time() - 1,))
+    assert delivery_outbox.due_deliveries() == [('m1', 'slot')]
+    assert delivery_outbox.claim('m1', 'slot') == ['@a']
+
+
+def test_prune_keeps_pending_items(delivery_outbox):
+    delivery_outbox.enqueue('m1', 'slot', ['@a', '@b'])
+    delivery_outbox.mark_sent('m1', 'slot', '@a')
+    delivery_outbox.conn.execute("UPDATE outbox SET updated_at = 0")
+    delivery_outbox.prune()
+    assert [row[0] for row in delivery_outbox.conn.execute("SELECT recipient FROM outbox")] == ['@b']
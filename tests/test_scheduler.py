@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+
+from models import Message
+from scheduler import Scheduler
+
+UTC = timezone.utc
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=UTC)
+
+
+def daily(msg_id, time):
+    return Message.from_dict(msg_id, {'text': msg_id, 'schedule': {'type': 'daily', 'time': time, 'timezone': 'UTC'}})
+
+
+def test_load_skips_manual_messages():
+    scheduler = Scheduler()
+    messages = {
+        'a': daily('a', '09:00'),
+        'manual': Message.from_dict('manual', {'text': 'manual'}),
+    }
+    scheduler.load(messages, now=utc(2024, 3, 1, 8, 0))
+    assert len(scheduler) == 1
+    assert scheduler.next_deadline() == utc(2024, 3, 1, 9, 0)
+
+
+def test_pop_due_in_order_and_pushes_next_occurrence():
+    scheduler = Scheduler()
+    scheduler.load({'a': daily('a', '09:00'), 'b': daily('b', '08:30')}, now=utc(2024, 3, 1, 8, 0))
+
+    due = scheduler.pop_due(now=utc(2024, 3, 1, 8, 59))
+    assert [(msg_id, fire_time, message.text) for msg_id, fire_time, message in due] == [('b', utc(2024, 3, 1, 8, 30), 'b')]
+    due = scheduler.pop_due(now=utc(2024, 3, 1, 9, 0))
+    assert [(msg_id, fire_time) for msg_id, fire_time, _ in due] == [('a', utc(2024, 3, 1, 9, 0))]
+    # Both were rescheduled for the next day
+    assert scheduler.next_deadline() == utc(2024, 3, 2, 8, 30)
+    assert scheduler.checked_until == utc(2024, 3, 1, 9, 0)
+
+
+def test_late_pass_fires_once_per_message():
+    scheduler = Scheduler()
+    scheduler.load({'a': daily('a', '09:00')}, now=utc(2024, 3, 1, 8, 0))
+    # Woken up three days late: one firing, then the next future occurrence
+    due = scheduler.pop_due(now=utc(2024, 3, 4, 12, 0))
+    assert [fire_time for _, fire_time, _ in due] == [utc(2024, 3, 1, 9, 0)]
+    assert scheduler.next_deadline() == utc(2024, 3, 5, 9, 0)
+
+
+def test_reload_keeps_deadlines_since_last_pass():
+    scheduler = Scheduler()
+    messages = {'a': daily('a', '09:00')}
+    scheduler.load(messages, now=utc(2024, 3, 1, 8, 0))
+    scheduler.pop_due(now=utc(2024, 3, 1, 8, 59))
+    # A reload just after the deadline still fires it
+    scheduler.load(messages, now=utc(2024, 3, 1, 9, 1))
+    assert [m for m, _, _ in scheduler.pop_due(now=utc(2024, 3, 1, 9, 1))] == ['a']
+
+
+def test_removed_message_is_not_fired():
+    scheduler = Scheduler()
+    scheduler.load({'a': daily('a', '09:00')}, now=utc(2024, 3, 1, 8, 0))
+    scheduler.load({}, now=utc(2024, 3, 1, 8, 30))
+    assert scheduler.pop_due(now=utc(2024, 3, 1, 9, 0)) == []
+    assert scheduler.next_deadline() is None
+
+
+def test_catch_up_fires_once():
+    scheduler = Scheduler()
+    scheduler.load({'a': daily('a', '09:00')}, now=utc(2024, 3, 1, 8, 0))
+    scheduler.add_catch_up('a', utc(2024, 2, 29, 9, 0))
+    scheduler.add_catch_up('unknown', utc(2024, 2, 29, 9, 0))
+    due = scheduler.pop_due(now=utc(2024, 3, 1, 8, 0))
+    assert [(m, t) for m, t, _ in due] == [('a', utc(2024, 2, 29, 9, 0))]
+    # The catch-up is not recurring; the regular occurrence is untouched
+    assert scheduler.next_deadline() == utc(2024, 3, 1, 9, 0)
+    assert [t for _, t, _ in scheduler.pop_due(now=utc(2024, 3, 2, 0, 0))] == [utc(2024, 3, 1, 9, 0)]
+
+
+def test_prewarm_once_per_occurrence():
+    scheduler = Scheduler(prewarm_lead=timedelta(minutes=10))
+    scheduler.load({'a': daily('a', '09:00')}, now=utc(2024, 3, 1, 8, 0))
+
+    assert scheduler.pop_prewarm(now=utc(2024, 3, 1, 8, 49)) == []
+    assert [(m, t) for m, t, _ in scheduler.pop_prewarm(now=utc(2024, 3, 1, 8, 50))] == [('a', utc(2024, 3, 1, 9, 0))]
+    assert scheduler.pop_prewarm(now=utc(2024, 3, 1, 8, 55)) == []
+
+    # A reload before the fire time does not pre-warm the same occurrence again
+    scheduler.load({'a': daily('a', '09:00')}, now=utc(2024, 3, 1, 8, 56))
+    assert scheduler.pop_prewarm(now=utc(2024, 3, 1, 8, 57)) == []
+
+    scheduler.pop_due(now=utc(2024, 3, 1, 9, 0))
+    assert [t for _, t, _ in scheduler.pop_prewarm(now=utc(2024, 3, 2, 8, 50))] == [utc(2024, 3, 2, 9, 0)]
+
+
+def test_prewarm_skipped_once_fire_time_passed():
+    scheduler = Scheduler(prewarm_lead=timedelta(minutes=10))
+    scheduler.load({'a': daily('a', '09:00')}, now=utc(2024, 3, 1, 8, 0))
+    assert scheduler.pop_prewarm(now=utc(2024, 3, 1, 9, 5)) == []
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telethon')
+pytest.importorskip('dotenv')
+
+from telethon import errors  # noqa: E402
+from telethon.tl.types import UpdatesTooLong  # noqa: E402
+
+from flood_governor import FloodGovernor, GovernedTelegramClient  # noqa: E402
+from models import Message  # noqa: E402
+from outbox import DeliveryOutbox  # noqa: E402
+from telegram_sender import TelegramSender  # noqa: E402
+
+
+class FakeSender:
+    """Stands in for the MTProto sender: FloodWaits for chats in `flooded`, success elsewhere."""
+
+    def __init__(self, flooded, seconds=120):
+        self.flooded = flooded
+        self.seconds = seconds
+        self.sent = []
+
+    def send(self, request, ordered=False):
+        self.sent.append(request.peer.chat_id)
+        future = asyncio.get_running_loop().create_future()
+        if request.peer.chat_id in self.flooded:
+            future.set_exception(errors.FloodWaitError(request=request, capture=self.seconds))
+        else:
+            future.set_result(UpdatesTooLong())
+        return future
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('API_ID', '1')
+    monkeypatch.setenv('API_HASH', 'hash')
+    monkeypatch.setenv('PHONE_NUMBER', '+10000000000')
+    monkeypatch.setenv('STATE_DB', str(tmp_path / 'state.db'))
+    return tmp_path
+
+
+def test_flood_wait_in_one_lane_does_not_stop_the_others(env):
+    fake = FakeSender(flooded={1})
+
+    async def run():
+        client = GovernedTelegramClient(None, 1, 'hash', governor=FloodGovernor())
+        client._sender = fake
+        manager = SimpleNamespace(client=client, session=f'lanes-{time.monotonic_ns()}')
+        sender = TelegramSender(log_func=lambda _: None, client_manager=manager, outbox=DeliveryOutbox())
+        message = Message.from_dict('m', {'text': 'hi', 'recipients': '-1, -2'})
+        lane_a, lane_b = message.recipients
+
+        # Lane A floods and is deferred to the outbox; lane B is sent afterwards
+        first = await sender._run_plan([(message, [lane_a], 'slot')])
+        second = await sender._run_plan([(message, [lane_b], 'slot')])
+        limiter = sender.primary.rate_limiter
+        return first, second, limiter.lane('-1').paused_until, limiter.lane('-2').paused_until
+
+    first, second, paused_a, paused_b = asyncio.run(run())
+    assert first == [(0, 1, False)]
+    assert second == [(1, 0, False)]
+    assert fake.sent == [1, 2]
+    assert paused_a > time.monotonic() and paused_b == 0
+
+
+def test_failed_preparation_fails_only_its_recipients(env, monkeypatch):
+    fake = FakeSender(flooded=set())
+
+    async def broken_prepare(self, image_paths):
+        raise FileNotFoundError('photo.jpg')
+
+    monkeypatch.setattr('media.MediaUploader.prepare', broken_prepare)
+
+    async def run():
+        client = GovernedTelegramClient(None, 1, 'hash', governor=FloodGovernor())
+        client._sender = fake
+        manager = SimpleNamespace(client=client, session=f'prepare-{time.monotonic_ns()}')
+        outbox = DeliveryOutbox()
+        sender = TelegramSender(log_func=lambda _: None, client_manager=manager, outbox=outbox)
+        with_image = Message.from_dict('a', {'text': 'hi', 'recipients': '-1', 'image_paths': 'photo.jpg'})
+        text_only = Message.from_dict('b', {'text': 'hi', 'recipients': '-2'})
+        jobs = []
+        for message in (with_image, text_only):
+            outbox.enqueue(message.msg_id, 'slot', [r.raw for r in message.recipients])
+            jobs.append((message, sender._claim_from_outbox(message, 'slot'), 'slot'))
+        return await sender._run_plan(jobs), outbox
+
+    results, outbox = asyncio.run(run())
+    assert results == [(0, 1, False), (1, 0, False)]
+    assert fake.sent == [2]
+    # The failure is recorded, so the item is retried instead of staying leased
+    assert outbox.conn.execute(
+        "SELECT status, attempts, last_error FROM outbox WHERE msg_id = 'a'"
+    ).fetchone() == ('pending', 1, 'photo.jpg')
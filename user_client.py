@@ -0,0 +1,67 @@
+"""
+Long-lived user-account client shared by every subsystem of the bot process.
+Connects lazily on first use, reconnects if the connection was lost, and
+caches the account info, so scheduled sends, Send Now, Find ID, cleanup and
+Auth all reuse one MTProto connection and one session file.
+"""
+import asyncio
+import os
+
+from flood_governor import GovernedTelegramClient
+
+DEFAULT_SESSION = 'session'
+
+
+def create_user_client(session=DEFAULT_SESSION):
+    # Every request is paced by the account's FloodGovernor (shared per session name)
+    return GovernedTelegramClient(
+        session,
+        int(os.getenv('API_ID')),
+        os.getenv('API_HASH'),
+        device_model="Windows 11",
+        system_version="10.0.22621",
+        app_version="4.11.2"
+    )
+
+
+class UserClientManager:
+    def __init__(self, session=DEFAULT_SESSION):
+        self.session = session
+        self._client = None
+        self._me = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def client(self):
+        """The underlying TelegramClient (created on first access, not connected)."""
+        if self._client is None:
+            self._client = create_user_client(self.session)
+        return self._client
+
+    async def get_client(self):
+        """Return the shared client, connecting or reconnecting it if needed."""
+        client = self.client
+        if client.is_connected():
+            return client
+        async with self._lock:
+            if not client.is_connected():
+                await client.connect()
+        return client
+
+    async def get_authorized_client(self):
+        """Like get_client(), but raises RuntimeError if the session is not logged in."""
+        client = await self.get_client()
+        if not await client.is_user_authorized():
+            raise RuntimeError("User session not authorized. Use **🔑 Auth** first.")
+        return client
+
+    async def get_me(self, refresh=False):
+        """Cached account info of the logged-in user."""
+        if self._me is None or refresh:
+            client = await self.get_authorized_client()
+            self._me = await client.get_me()
+        return self._me
+
+    async def disconnect(self):
+        if self._client is not None and self._client.is_connected():
+            await self._client.disconnect()